@@ -1,5 +1,12 @@
 import os
+import io
+import glob
+import json
 import time
+import shutil
+import hashlib
+import asyncio
+import threading
 import boto3
 import botocore
 import datetime
@@ -7,18 +14,24 @@ import psutil  # To check available RAM
 import pandas as pd
 from pprint import pprint
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from boto3.s3.transfer import TransferConfig
+from functools import partial
+import bisect
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
 import pyarrow.parquet as pq
-import gzip
+
+COLUMNS_TO_KEEP = ['query_name', 'query_type', 'response_type', 'ip4_address', 'ip6_address', 'country', 'as', 'as_full', 'ip_prefix']
+# A row is kept if any of these is present (non-empty)
+RECORD_COLUMNS = ['ip4_address', 'ip6_address', 'country', 'as', 'as_full', 'ip_prefix']
 
 def get_parquet_columns(file_path):
     """Extract specific columns from a Parquet file into a Pandas DataFrame and remove invalid rows."""
-    columns_to_keep = ['query_name', 'query_type', 'response_type', 'ip4_address', 'ip6_address', 'country', 'as', 'as_full', 'ip_prefix']
-    df = pq.read_table(file_path, columns=columns_to_keep).to_pandas()
+    df = pq.read_table(file_path, columns=COLUMNS_TO_KEEP).to_pandas()
     # Replace empty strings with NaN so they are considered missing
     df.replace("", pd.NA, inplace=True)
     # Drop rows where all values except 'query_name', 'query_type', "response_type" are missing
-    df = df.dropna(subset=['ip4_address', 'ip6_address', 'country', 'as', 'as_full', 'ip_prefix'], how='all')
+    df = df.dropna(subset=RECORD_COLUMNS, how='all')
     
     # Print DataFrame head for debugging
     print("DataFrame Head:")
@@ -34,17 +47,18 @@ def get_optimal_chunksize(file_size):
     return chunk_size
 
 # **Step 2: Initialize OpenINTEL S3**
-OI_ENDPOINT = "https://object.openintel.nl"
-OI_BUCKET_NAME = "openintel-public"
+# Override with e.g. OI_ENDPOINT=http://localhost:9000 to run against a local S3 stand-in (MinIO, moto_server)
+OI_ENDPOINT = os.environ.get("OI_ENDPOINT", "https://object.openintel.nl")
+OI_BUCKET_NAME = os.environ.get("OI_BUCKET_NAME", "openintel-public")
 OI_FDNS_LISTBASED = "fdns/basis=toplist"
 DO_SOURCES = ["tranco", "umbrella", "crux", "radar", "majestic"]
 GLOBAL_SCOPE = 'global'
 
 # Create local directories to save files
 SAVE_DIR = "openintel_data"
-TEMP_DIR = "temp_downloads"
+STORE_DIR = os.path.join(SAVE_DIR, "store")  # Partial downloads + completion journal (see ObjectStore)
+DATASET_DIR = os.path.join(SAVE_DIR, "dataset")  # source=/year=/month=/day=/part-<key hash>.parquet
 os.makedirs(SAVE_DIR, exist_ok=True)
-os.makedirs(TEMP_DIR, exist_ok=True)
 
 # Initialize OpenIntel S3 Resource (More Stable than Client)
 s3_resource = boto3.resource(
@@ -67,73 +81,150 @@ def check_file_exists(bucket, key):
         return False
 
 # **Step 3: Get Latest Available Dataset for Each Source**
-def get_all_available_dates(source):
-    """List all available datasets for a source and return the most recent date."""
+MANIFEST_PATH = os.path.join(SAVE_DIR, "s3_manifest.parquet")
+
+def source_prefix(source):
     if source == 'crux':
-        prefix = f"{OI_FDNS_LISTBASED}/source={source}/country-code={GLOBAL_SCOPE}"
-    else:
-        prefix = f"{OI_FDNS_LISTBASED}/source={source}/"
-    available_dates = []
-    continuation_token = None
+        return f"{OI_FDNS_LISTBASED}/source={source}/country-code={GLOBAL_SCOPE}"
+    return f"{OI_FDNS_LISTBASED}/source={source}/"
 
+def key_date(key):
+    """Date of an object from its .../year=/month=/day=/file key, or None."""
+    parts = key.split("/")
+    try:
+        year = int(parts[-4].split("=")[1])
+        month = int(parts[-3].split("=")[1])
+        day = int(parts[-2].split("=")[1])
+        return datetime.date(year, month, day)
+    except (IndexError, ValueError):
+        return None
+
+def list_keys(prefix, start_after=None):
+    """All objects under prefix (after start_after, if given), paging with continuation tokens."""
+    objects, kwargs = [], {"Bucket": OI_BUCKET_NAME, "Prefix": prefix}
+    if start_after:
+        kwargs["StartAfter"] = start_after
     while True:
-        if continuation_token:
-            response = s3_bucket.meta.client.list_objects_v2(
-                Bucket=OI_BUCKET_NAME, Prefix=prefix, ContinuationToken=continuation_token
-            )
-        else:
-            response = s3_bucket.meta.client.list_objects_v2(
-                Bucket=OI_BUCKET_NAME, Prefix=prefix
-            )
-
-        if "Contents" in response:
-            for obj in response["Contents"]:
-                parts = obj["Key"].split("/")
-                try:
-                    year = int(parts[-4].split("=")[1])
-                    month = int(parts[-3].split("=")[1])
-                    day = int(parts[-2].split("=")[1])
-                    available_dates.append(datetime.date(year, month, day))
-                except (IndexError, ValueError):
-                    continue
+        response = s3_bucket.meta.client.list_objects_v2(**kwargs)
+        objects.extend(response.get("Contents", []))
+        if not response.get("IsTruncated"):
+            return objects
+        kwargs["ContinuationToken"] = response["NextContinuationToken"]
 
-        if response.get("IsTruncated"):
-            continuation_token = response["NextContinuationToken"]
-        else:
-            break
+class S3Manifest:
+    """
+    Local index of the OpenINTEL listing (source, date, key, size, etag), persisted between runs.
+
+    Keys are date-partitioned and listed in lexicographic order, so update() only asks S3 for keys
+    after the last one seen per source (StartAfter); date discovery and object selection are then
+    answered locally. Use update(refresh=True) to re-list everything, e.g. if old days were rewritten.
+    """
+    COLUMNS = ["source", "date", "key", "size", "etag"]
+
+    def __init__(self, df=None, path=MANIFEST_PATH):
+        self.df = pd.DataFrame(columns=self.COLUMNS) if df is None else df
+        self.path = path
+
+    @classmethod
+    def load(cls, path=MANIFEST_PATH):
+        return cls(pd.read_parquet(path), path) if os.path.exists(path) else cls(path=path)
 
-    return sorted(available_dates, reverse=True)
+    def save(self):
+        temp_path = self.path + ".tmp"
+        self.df.to_parquet(temp_path, index=False)
+        os.replace(temp_path, self.path)
+
+    def update(self, sources, refresh=False):
+        """Fetch the keys added since the last run (one listing request per source if nothing is new)."""
+        for source in sources:
+            known = self.df[self.df["source"] == source]
+            if refresh:
+                self.df, known = self.df[self.df["source"] != source], known.iloc[:0]
+            start_after = known["key"].max() if len(known) else None
+            new = [{"source": source, "date": key_date(obj["Key"]), "key": obj["Key"], "size": obj.get("Size", 0), "etag": obj.get("ETag", "")}
+                   for obj in list_keys(source_prefix(source), start_after)]
+            new = [obj for obj in new if obj["date"] is not None]
+            print(f"📒 Manifest: {len(new)} new objects for {source} (after {start_after or 'start'})")
+            if new:
+                self.df = pd.concat([self.df, pd.DataFrame(new, columns=self.COLUMNS)], ignore_index=True)
+        self.save()
+
+    def dates(self, source):
+        return sorted(set(self.df.loc[self.df["source"] == source, "date"]), reverse=True)
+
+    def objects(self, source, day):
+        rows = self.df[(self.df["source"] == source) & (self.df["date"] == day)]
+        return rows[["key", "size", "etag"]].to_dict("records")
+
+def get_all_available_dates(source, manifest=None):
+    """List all available datasets for a source (newest first), from the manifest when given."""
+    if manifest is not None:
+        return manifest.dates(source)
+    return sorted(filter(None, (key_date(obj["Key"]) for obj in list_keys(source_prefix(source)))), reverse=True)
 
 # **Step 4: Download Files and Extract Specific Columns**
-def download_and_extract_columns(bucket, key, file_size, source, latest_date, max_retries=5):
-    """Download an S3 file, extract specific columns into a DataFrame, and display it."""
-    if not check_file_exists(bucket, key):
+# One typed Parquet dataset, Hive-partitioned by source and day; the high-cardinality, highly repetitive
+# query_name and ip_prefix columns are dictionary-encoded (and read back as Arrow dictionaries)
+DATASET_SCHEMA = pa.schema([
+    (name, pa.dictionary(pa.int32(), pa.string()) if name in ("query_name", "ip_prefix") else pa.string())
+    for name in COLUMNS_TO_KEEP
+])
+DATASET_PARTITIONING = ds.partitioning(
+    pa.schema([("source", pa.string()), ("year", pa.int16()), ("month", pa.int8()), ("day", pa.int8())]), flavor="hive")
+
+def day_partition(source, day, root=DATASET_DIR):
+    return os.path.join(root, f"source={source}", f"year={day.year}", f"month={day.month:02d}", f"day={day.day:02d}")
+
+def save_dataset_part(table, source, latest_date, key, root=DATASET_DIR):
+    """
+    Write one object's filtered rows as part-<hash of its S3 key>.parquet in its day partition; returns the
+    bytes written. A rewritten object (new ETag) thus replaces its earlier part instead of adding a second one.
+    Written under a temporary name and renamed, so an interrupted write never leaves a truncated part.
+    """
+    columns = [table.column(field.name).cast(field.type) if field.name in table.column_names else pa.nulls(table.num_rows, field.type)
+               for field in DATASET_SCHEMA]
+    path = os.path.join(day_partition(source, latest_date, root), f"part-{hashlib.sha256(key.encode()).hexdigest()[:12]}.parquet")
+    temp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    pq.write_table(pa.Table.from_arrays(columns, schema=DATASET_SCHEMA), temp_path, compression="zstd")
+    os.replace(temp_path, path)
+    print(f"Successfully saved: {path} ({table.num_rows} rows)")
+    return os.path.getsize(path)
+
+def week_view(week_start, sources=None, root=DATASET_DIR, days=7):
+    """
+    Lazy pyarrow Dataset over the day partitions of one week (week_start: date or "YYYYMMDD"), optionally
+    restricted to some sources. Nothing is read until it is scanned, e.g.
+    week_view("20250414", ["tranco"]).to_table(columns=["query_name", "ip_prefix"], filter=ds.field("day") == 14)
+    """
+    if isinstance(week_start, str):
+        week_start = datetime.datetime.strptime(week_start, "%Y%m%d").date()
+    paths = []
+    for offset in range(days):
+        day = week_start + datetime.timedelta(days=offset)
+        for source in sources or ["*"]:
+            paths.extend(glob.glob(os.path.join(day_partition(source, day, root), "*.parquet")))
+    return ds.dataset(sorted(paths), schema=pa.unify_schemas([DATASET_SCHEMA, DATASET_PARTITIONING.schema]),
+                      format="parquet", partitioning=DATASET_PARTITIONING, partition_base_dir=root)
+
+def download_and_extract_columns(bucket, key, file_size, source, latest_date, max_retries=5, verify=True, etag="", store=None):
+    """Download an S3 file (resumably, into the store), extract specific columns and save them."""
+    store = store if store is not None else ObjectStore()
+    if store.is_done(key, etag):
+        print(f"⏭️ Already collected: {key}")
+        return True
+    if verify and not check_file_exists(bucket, key):
         return False
     
     retries = 0
     wait_time = 0
-    optimal_chunk_size = get_optimal_chunksize(file_size)
-    transfer_config = TransferConfig(multipart_chunksize=optimal_chunk_size)
-    temp_file_path = os.path.join(TEMP_DIR, os.path.basename(key))
 
     while retries < max_retries:
         try:
-            with open(temp_file_path, "wb") as tempFile:
-                print(f"Downloading {key} -> {temp_file_path} (temporary)")
-                s3_bucket.download_fileobj(Key=key, Fileobj=tempFile, Config=transfer_config)
-            
-            df = get_parquet_columns(temp_file_path)
-            final_path = f"openintel_data/{source}_{latest_date}.csv"
-            compressed_path = f"openintel_data/{source}_{latest_date}.csv.gz"
-            
-            df.to_csv(final_path, index=False)
-            print(f"Successfully saved CSV: {final_path}")
-            
-            # Save as compressed CSV (gzip)
-            with gzip.open(compressed_path, 'wt', encoding='utf-8') as gzfile:
-                df.to_csv(gzfile, index=True)
-            print(f"Successfully saved compressed CSV: {compressed_path}")
-            os.remove(temp_file_path)  # Clean up temporary file
+            file_path = store.download(key, file_size, etag)
+            df = get_parquet_columns(file_path)
+            save_dataset_part(pa.Table.from_pandas(df, preserve_index=False), source, latest_date, key)
+            store.complete(key, etag, source=source, date=latest_date, rows=len(df))
             return True
         except botocore.exceptions.ClientError as e:
             if e.response["Error"]["Code"] == "503":
@@ -148,61 +239,414 @@ def download_and_extract_columns(bucket, key, file_size, source, latest_date, ma
     print(f"Max retries reached for {key}. Skipping...")
     return False
 
+# **Step 4a: Resumable Local Object Store**
+RESUME_CHUNK_BYTES = 64 * 1024 * 1024  # Whole-object downloads are appended (and resumed) in ranges of at most this size
+
+def atomic_write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(data)
+    os.replace(temp_path, path)
+
+class ObjectStore:
+    """
+    Local store of OpenINTEL objects keyed by S3 key + ETag, with an append-only completion journal.
+
+    Every object gets a directory named by the hash of its key and ETag, holding the byte ranges or
+    the partial download fetched so far; an interrupted run picks up from there instead of starting
+    over. Once an object's outputs are written, complete() appends it to journal.jsonl and drops its
+    directory, and reruns skip it without a request. A rewritten object (new ETag) is a new entry, whose
+    dataset part overwrites the old one (see save_dataset_part).
+    """
+
+    def __init__(self, root=STORE_DIR):
+        self.root = root
+        self.journal_path = os.path.join(root, "journal.jsonl")
+        self.lock = threading.Lock()
+        self.done = {}
+        os.makedirs(root, exist_ok=True)
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path) as journal:
+                for line in journal:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # Torn last line of a run killed mid-append
+                    self.done[entry["id"]] = entry
+
+    @staticmethod
+    def object_id(key, etag):
+        return hashlib.sha256(f"{key}\n{etag}".encode()).hexdigest()
+
+    def object_dir(self, key, etag):
+        object_id = self.object_id(key, etag)
+        return os.path.join(self.root, "objects", object_id[:2], object_id)
+
+    def is_done(self, key, etag):
+        return self.object_id(key, etag) in self.done
+
+    def get_range(self, key, start, end, etag=None):
+        """get_range, served from disk if an earlier (interrupted) run already fetched this range."""
+        path = os.path.join(self.object_dir(key, etag), f"{start}-{end}.range")
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                return f.read()
+        data = get_range(key, start, end, etag)
+        atomic_write(path, data)
+        return data
+
+    def download(self, key, size, etag=None):
+        """Download a whole object as consecutive ranged GETs appended to a .part file, resuming at its current length."""
+        path = os.path.join(self.object_dir(key, etag), os.path.basename(key))
+        if os.path.exists(path):
+            return path
+        size = size or s3_resource.Object(OI_BUCKET_NAME, key).content_length
+        chunk_size = int(min(get_optimal_chunksize(size), RESUME_CHUNK_BYTES))
+        partial_path = path + ".part"
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        offset = os.path.getsize(partial_path) if os.path.exists(partial_path) else 0
+        if offset:
+            print(f"↩️ Resuming {key} at {offset / 2**20:.1f} of {size / 2**20:.1f} MB")
+        else:
+            print(f"Downloading {key} -> {partial_path}")
+        with open(partial_path, "ab") as f:
+            while offset < size:
+                end = min(offset + chunk_size, size) - 1
+                f.write(get_range(key, offset, end, etag))
+                f.flush()
+                offset = end + 1
+        os.replace(partial_path, path)
+        return path
+
+    def complete(self, key, etag, **record):
+        """Journal an object as finished (fsynced) and remove its partial data."""
+        entry = dict(record, id=self.object_id(key, etag), key=key, etag=etag,
+                     finished=datetime.datetime.now().isoformat(timespec="seconds"))
+        line = json.dumps(entry, default=str) + "\n"
+        with self.lock:
+            with open(self.journal_path, "a") as journal:
+                journal.write(line)
+                journal.flush()
+                os.fsync(journal.fileno())
+            self.done[entry["id"]] = entry
+        shutil.rmtree(self.object_dir(key, etag), ignore_errors=True)
+
+# **Step 4b: Streaming Column Projection (ranged GETs, no temp files)**
+FOOTER_BYTES = 64 * 1024  # First guess for the footer; one more GET if the metadata is larger
+RANGE_MERGE_GAP = 1024 * 1024  # Column chunks closer than this are fetched in one GET
+STREAM_BATCH_ROWS = 64 * 1024
+
+class SparseObject(io.RawIOBase):
+    """Seekable read-only view of a remote object of which only some byte ranges were fetched."""
+
+    def __init__(self, size, ranges):
+        self.size = size
+        self.ranges = sorted(ranges)
+        self.starts = [start for start, _ in self.ranges]
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        self.position = {io.SEEK_SET: 0, io.SEEK_CUR: self.position, io.SEEK_END: self.size}[whence] + offset
+        return self.position
+
+    def readinto(self, buffer):
+        wanted = min(len(buffer), self.size - self.position)
+        done = 0
+        while done < wanted:
+            i = bisect.bisect_right(self.starts, self.position) - 1
+            start, data = self.ranges[i] if i >= 0 else (0, b"")
+            offset = self.position - start
+            if offset >= len(data):
+                raise IOError(f"Byte {self.position} was not fetched")
+            chunk = data[offset:offset + wanted - done]
+            buffer[done:done + len(chunk)] = chunk
+            done += len(chunk)
+            self.position += len(chunk)
+        return done
+
+    @property
+    def fetched_bytes(self):
+        return sum(len(data) for _, data in self.ranges)
+
+def get_range(key, start, end, etag=None, max_retries=5):
+    """GET bytes start..end (inclusive) of an object, pinned to its ETag, backing off on 503."""
+    kwargs = {"Bucket": OI_BUCKET_NAME, "Key": key, "Range": f"bytes={start}-{end}"}
+    if etag:
+        kwargs["IfMatch"] = etag
+    wait_time = 0
+    for _ in range(max_retries):
+        try:
+            return s3_bucket.meta.client.get_object(**kwargs)["Body"].read()
+        except botocore.exceptions.ClientError as e:
+            if e.response["Error"]["Code"] != "503":
+                raise
+            wait_time += 10
+            print(f"503 Service Unavailable. Retrying in {wait_time:.2f} seconds...")
+            time.sleep(wait_time)
+    raise RuntimeError(f"Max retries reached for {key}")
+
+def column_chunk_spans(metadata, columns):
+    """Merged (start, end) byte spans of the given columns' chunks in every row group."""
+    index = {metadata.schema.column(j).name: j for j in range(metadata.num_columns)}
+    spans = []
+    for i in range(metadata.num_row_groups):
+        row_group = metadata.row_group(i)
+        for name in columns:
+            if name not in index:
+                continue
+            chunk = row_group.column(index[name])
+            start = chunk.data_page_offset
+            if chunk.has_dictionary_page and chunk.dictionary_page_offset:
+                start = min(start, chunk.dictionary_page_offset)
+            spans.append((start, start + chunk.total_compressed_size))
+    merged = []
+    for start, end in sorted(spans):
+        if merged and start - merged[-1][1] <= RANGE_MERGE_GAP:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+def fetch_projection(key, size, etag=None, columns=COLUMNS_TO_KEEP, store=None):
+    """Fetch only the footer and the needed column chunks of a Parquet object into a SparseObject."""
+    fetch_range = store.get_range if store is not None else get_range
+    tail = fetch_range(key, max(0, size - FOOTER_BYTES), size - 1, etag)
+    metadata_length = int.from_bytes(tail[-8:-4], "little")
+    if tail[-4:] != b"PAR1":
+        raise IOError(f"{key} is not a Parquet file")
+    if metadata_length + 8 > len(tail):
+        tail = fetch_range(key, size - metadata_length - 8, size - 1, etag)
+    footer = (size - len(tail), tail)
+    metadata = pq.ParquetFile(SparseObject(size, [footer])).metadata
+    ranges = [(start, fetch_range(key, start, end - 1, etag)) for start, end in column_chunk_spans(metadata, columns)]
+    return SparseObject(size, ranges + [footer])
+
+def blank_to_null(array):
+    """Empty strings as nulls, like get_parquet_columns' replace("", NA); dictionary columns are decoded first."""
+    if pa.types.is_dictionary(array.type):
+        array = array.dictionary_decode()
+    if pa.types.is_string(array.type) or pa.types.is_large_string(array.type):
+        return pc.if_else(pc.equal(array, ""), pa.scalar(None, array.type), array)
+    return array
+
+def filter_record_batches(source, columns=COLUMNS_TO_KEEP):
+    """
+    Arrow-only equivalent of get_parquet_columns: stream record batches, turn empty strings into nulls
+    and keep rows with at least one of RECORD_COLUMNS; returns a (small) pyarrow Table.
+    """
+    parquet_file = pq.ParquetFile(source)
+    present = [name for name in columns if name in parquet_file.schema_arrow.names]
+    tables = []
+    for batch in parquet_file.iter_batches(columns=present, batch_size=STREAM_BATCH_ROWS):
+        arrays = [blank_to_null(array) for array in batch.columns]
+        mask = None
+        for name, array in zip(present, arrays):
+            if name in RECORD_COLUMNS:
+                mask = array.is_valid() if mask is None else pc.or_(mask, array.is_valid())
+        table = pa.Table.from_arrays(arrays, names=present)
+        tables.append(table if mask is None else table.filter(mask))
+    return pa.concat_tables(tables) if tables else parquet_file.schema_arrow.empty_table().select(present)
+
 # **Step 5: Find and Process the Latest Datasets**
 DATES_TO_PROCESS = pd.date_range(start="2025-03-24", end="2025-04-20").to_pydatetime()
-all_datasets = {source: get_all_available_dates(source) for source in DO_SOURCES}
-
-print("Available date ranges for each source:")
-for source, dates in all_datasets.items():
-    if dates:
-        print(f"{source}: {dates[-1]} to {dates[0]}")
-    else:
-        print(f"{source}: No available dates found.")
-
-with ThreadPoolExecutor(max_workers=4) as executor:
-    future_to_file = {}
-
-    for source in DO_SOURCES:
-        available_dates = all_datasets.get(source, [])
-        for target_date in DATES_TO_PROCESS:
-            specific_date = target_date.date()
-            if specific_date not in available_dates:
-                print(f"❌ {specific_date} not available for {source}. Skipping...")
-                continue
 
-            if source == 'crux':
-                prefix = f"{OI_FDNS_LISTBASED}/source={source}/country-code={GLOBAL_SCOPE}/year={specific_date.year}/month={specific_date.month:02d}/day={specific_date.day:02d}/"
-            else:
-                prefix = f"{OI_FDNS_LISTBASED}/source={source}/year={specific_date.year}/month={specific_date.month:02d}/day={specific_date.day:02d}/"
+def load_manifest(sources):
+    """The persisted listing manifest, brought up to date for the given sources."""
+    manifest = S3Manifest.load()
+    manifest.update(sources)
+    return manifest
 
-            print(f"🔍 Searching files for {source} on {specific_date}: {prefix}")
-            response = s3_bucket.meta.client.list_objects_v2(Bucket=OI_BUCKET_NAME, Prefix=prefix)
+def collect_threaded(dates_to_process, manifest=None, store=None):
+    """Original collector: one thread per object download + decode + write (no stage overlap)."""
+    manifest = manifest if manifest is not None else load_manifest(DO_SOURCES)
+    store = store if store is not None else ObjectStore()
+    all_datasets = {source: get_all_available_dates(source, manifest) for source in DO_SOURCES}
 
-            if "Contents" not in response:
-                print(f"⚠️ No files found for {source} on {specific_date}. Skipping...")
-                continue
+    print("Available date ranges for each source:")
+    for source, dates in all_datasets.items():
+        if dates:
+            print(f"{source}: {dates[-1]} to {dates[0]}")
+        else:
+            print(f"{source}: No available dates found.")
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        future_to_file = {}
+
+        for source in DO_SOURCES:
+            available_dates = all_datasets.get(source, [])
+            for target_date in dates_to_process:
+                specific_date = target_date.date()
+                if specific_date not in available_dates:
+                    print(f"❌ {specific_date} not available for {source}. Skipping...")
+                    continue
+
+                for obj in manifest.objects(source, specific_date):
+                    file_key = obj["key"]
+                    file_size = obj["size"]
+                    if store.is_done(file_key, obj["etag"]):
+                        print(f"⏭️ Already collected: {file_key}")
+                        continue
 
-            for obj in response["Contents"]:
-                file_key = obj["Key"]
-                file_size = obj.get("Size", 512 * 1024 * 1024)
-
-                print(f"📥 Queuing download: {file_key}")
-                future = executor.submit(
-                    download_and_extract_columns,
-                    OI_BUCKET_NAME,
-                    file_key,
-                    file_size,
-                    source,
-                    specific_date
-                )
-                future_to_file[future] = file_key
-
-    # **Wait for all downloads to complete**
-    for future in as_completed(future_to_file):
-        file_key = future_to_file[future]
+                    print(f"📥 Queuing download: {file_key}")
+                    future = executor.submit(
+                        download_and_extract_columns,
+                        OI_BUCKET_NAME,
+                        file_key,
+                        file_size,
+                        source,
+                        specific_date,
+                        verify=False,  # Known from the manifest; no HEAD needed
+                        etag=obj["etag"],
+                        store=store
+                    )
+                    future_to_file[future] = file_key
+
+        # **Wait for all downloads to complete**
+        for future in as_completed(future_to_file):
+            file_key = future_to_file[future]
+            try:
+                result = future.result()
+                if not result:
+                    print(f"Skipping {file_key} due to repeated failures.")
+            except Exception as e:
+                print(f"Unexpected error saving {file_key}: {e}")
+
+# **Step 6: Pipelined Collection (list → fetch → decode/filter → write)**
+# Each stage has its own worker limit; bounded queues between stages apply backpressure, so at most
+# QUEUE_DEPTH downloaded objects wait for decoding while the network, CPU and disk stages overlap.
+STAGE_WORKERS = {"list": 2, "fetch": 4, "decode": max(1, (os.cpu_count() or 2) - 1), "write": 2}
+QUEUE_DEPTH = 4
+REPORT_INTERVAL = 30  # seconds between throughput reports
+
+class StageStats:
+    """Items, bytes and busy time of one pipeline stage."""
+
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+        self.bytes = 0
+        self.busy = 0.0
+        self.failed = 0
+
+    def report(self, elapsed):
+        rate = self.bytes / max(elapsed, 1e-9) / 2**20
+        return (f"{self.name:>6}: {self.items} done, {self.failed} failed, {self.bytes / 2**20:.1f} MB "
+                f"({rate:.2f} MB/s, {self.items / max(elapsed, 1e-9):.2f} items/s, busy {self.busy:.1f}s)")
+
+async def stage_worker(handler, inbox, outbox, stats):
+    """Take items until the None sentinel; outbox.put blocks while the next stage is full."""
+    while (item := await inbox.get()) is not None:
+        start = time.perf_counter()
         try:
-            result = future.result()
-            if not result:
-                print(f"Skipping {file_key} due to repeated failures.")
+            results, nbytes = await handler(item)
         except Exception as e:
-            print(f"Unexpected error saving {file_key}: {e}")
\ No newline at end of file
+            print(f"Unexpected error in {stats.name} stage for {item.get('key', item)}: {e}")
+            stats.failed += 1
+            continue
+        finally:
+            stats.busy += time.perf_counter() - start
+        stats.items += 1
+        stats.bytes += nbytes
+        if outbox is not None:
+            for result in results:
+                await outbox.put(result)
+
+async def run_stage(name, handler, inbox, outbox, stats, downstream_workers):
+    """Run STAGE_WORKERS[name] workers, then pass one sentinel per downstream worker."""
+    await asyncio.gather(*(stage_worker(handler, inbox, outbox, stats) for _ in range(STAGE_WORKERS[name])))
+    if outbox is not None:
+        for _ in range(downstream_workers):
+            await outbox.put(None)
+
+def list_stage(manifest, store):
+    """List stage: (source, day) → one item per object not yet in the store's journal, without requests."""
+    async def list_day(item):
+        objects = [dict(item, **obj) for obj in manifest.objects(item["source"], item["day"])]
+        if not objects:
+            print(f"❌ {item['day']} not available for {item['source']}. Skipping...")
+        pending = [obj for obj in objects if not store.is_done(obj["key"], obj["etag"])]
+        if len(pending) < len(objects):
+            print(f"⏭️ {len(objects) - len(pending)} of {len(objects)} objects for {item['source']} {item['day']} already collected")
+        return pending, sum(obj["size"] for obj in pending)
+    return list_day
+
+async def fetch_object(item, store, executor=None):
+    """Fetch stage: ranged GETs of the footer and the needed column chunks only (resumed from the store)."""
+    loop = asyncio.get_running_loop()
+    projection = await loop.run_in_executor(executor, partial(fetch_projection, item["key"], item["size"], item.get("etag"), store=store))
+    return [dict(item, data=projection)], projection.fetched_bytes
+
+async def decode_object(item, executor=None):
+    """Decode/filter stage: stream the fetched column chunks through Arrow compute filters."""
+    loop = asyncio.get_running_loop()
+    table = await loop.run_in_executor(executor, filter_record_batches, item.pop("data"))
+    return [dict(item, table=table)], table.nbytes
+
+async def write_object(item, store, executor=None):
+    """Write stage: persist the filtered rows, then journal the object as done."""
+    table = item["table"]
+    loop = asyncio.get_running_loop()
+    nbytes = await loop.run_in_executor(executor, save_dataset_part, table, item["source"], item["day"], item["key"])
+    await loop.run_in_executor(executor, partial(store.complete, item["key"], item["etag"], source=item["source"], date=item["day"], rows=table.num_rows))
+    return [], nbytes
+
+async def report_progress(stats, queues, started):
+    while True:
+        await asyncio.sleep(REPORT_INTERVAL)
+        elapsed = time.perf_counter() - started
+        depths = ", ".join(f"{name}: {queue.qsize()}" for name, queue in queues.items())
+        print(f"⏱️ {elapsed:.0f}s | queued {depths}")
+        for stage in stats.values():
+            print("   " + stage.report(elapsed))
+
+async def collect_pipelined(sources, dates_to_process, manifest=None, store=None):
+    """List, fetch, decode and write concurrently; returns the per-stage StageStats."""
+    manifest = manifest if manifest is not None else await asyncio.to_thread(load_manifest, sources)
+    store = store if store is not None else ObjectStore()
+    names = ["list", "fetch", "decode", "write"]
+    # One thread pool per blocking stage, sized like the stage, so STAGE_WORKERS bounds its threads
+    executors = {name: ThreadPoolExecutor(max_workers=STAGE_WORKERS[name], thread_name_prefix=f"{name}-stage") for name in names[1:]}
+    handlers = {"list": list_stage(manifest, store), "fetch": partial(fetch_object, store=store, executor=executors["fetch"]),
+                "decode": partial(decode_object, executor=executors["decode"]), "write": partial(write_object, store=store, executor=executors["write"])}
+    queues = {name: asyncio.Queue(maxsize=QUEUE_DEPTH) for name in names}
+    stats = {name: StageStats(name) for name in names}
+    started = time.perf_counter()
+
+    async def produce():
+        for source in sources:
+            for target_date in dates_to_process:
+                await queues["list"].put({"source": source, "day": target_date.date()})
+        for _ in range(STAGE_WORKERS["list"]):
+            await queues["list"].put(None)
+
+    reporter = asyncio.create_task(report_progress(stats, queues, started))
+    try:
+        await asyncio.gather(produce(), *(
+            run_stage(name, handlers[name], queues[name], queues[names[i + 1]] if i + 1 < len(names) else None,
+                      stats[name], STAGE_WORKERS[names[i + 1]] if i + 1 < len(names) else 0)
+            for i, name in enumerate(names)))
+    finally:
+        reporter.cancel()
+        for executor in executors.values():
+            executor.shutdown(cancel_futures=True)
+    elapsed = time.perf_counter() - started
+    print(f"\n✅ Collection finished in {elapsed:.1f}s")
+    for stage in stats.values():
+        print("   " + stage.report(elapsed))
+    return stats
+
+if __name__ == "__main__":
+    asyncio.run(collect_pipelined(DO_SOURCES, DATES_TO_PROCESS))
+
+    # Uncomment to use the original thread-per-object collector instead
+    # collect_threaded(DATES_TO_PROCESS)
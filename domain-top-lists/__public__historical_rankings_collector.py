@@ -27,6 +27,9 @@ TRANCO_EMAIL = "PLACEHOLDER"
 TRANCO_API_TOKEN = "PLACEHOLDER"
 CLOUDFLARE_API_TOKEN = "PLACEHOLDER"
 
+# The DTL generator reads the .zip / .csv.gz archives directly; set True to also keep extracted CSVs
+KEEP_EXTRACTED_CSV = False
+
 os.makedirs("historical_data/majestic", exist_ok=True)
 os.makedirs("historical_data/umbrella", exist_ok=True)
 os.makedirs("historical_data/tranco", exist_ok=True)
@@ -52,7 +55,7 @@ def init_cache_from_folders():
         ("historical_data/majestic", "majestic-", ".zip"),
         ("historical_data/umbrella", "umbrella-", ".csv.zip"),
         ("historical_data/tranco", "tranco-", ".zip"),
-        ("historical_data/crux", "crux-", ".csv"),
+        ("historical_data/crux", "crux-", ".csv.gz"),
         ("historical_data/cloudflare", "cloudflare-", ".csv")
     ]:
         if os.path.exists(folder):
@@ -73,25 +76,27 @@ def download_and_keep_both(url, csv_file_path, zip_file_path):
             zf.write(resp.content)
         print(f"Saved ZIP: {zip_file_path}")
 
-        try:
-            with zipfile.ZipFile(zip_file_path, 'r') as zobj:
-                zobj.extractall(os.path.dirname(csv_file_path))
-            extracted = os.path.join(os.path.dirname(csv_file_path), "top-1m.csv")
-            if os.path.exists(extracted):
-                os.rename(extracted, csv_file_path)
-            print(f"Extracted CSV: {csv_file_path}")
-        except Exception as e:
-            print(f"Error extracting from {zip_file_path}: {e}")
-            return False
+        if KEEP_EXTRACTED_CSV:
+            try:
+                with zipfile.ZipFile(zip_file_path, 'r') as zobj:
+                    zobj.extractall(os.path.dirname(csv_file_path))
+                extracted = os.path.join(os.path.dirname(csv_file_path), "top-1m.csv")
+                if os.path.exists(extracted):
+                    os.rename(extracted, csv_file_path)
+                print(f"Extracted CSV: {csv_file_path}")
+            except Exception as e:
+                print(f"Error extracting from {zip_file_path}: {e}")
+                return False
     else:
-        with open(csv_file_path, 'wb') as f:
-            f.write(resp.content)
-        print(f"Saved CSV: {csv_file_path}")
-
         with zipfile.ZipFile(zip_file_path, mode='w', compression=zipfile.ZIP_DEFLATED) as z:
-            z.write(csv_file_path, arcname=os.path.basename(csv_file_path))
+            z.writestr(os.path.basename(csv_file_path), resp.content)
         print(f"Created local ZIP: {zip_file_path}")
 
+        if KEEP_EXTRACTED_CSV:
+            with open(csv_file_path, 'wb') as f:
+                f.write(resp.content)
+            print(f"Saved CSV: {csv_file_path}")
+
     return True
 
 # ---------------------------------------------------------------------
@@ -240,10 +245,11 @@ def download_crux_csv_for_dates(date_list):
                 f.write(resp.content)
             print(f"Saved CrUX gzip: {gz_file_path}")
 
-            with gzip.open(gz_file_path, 'rb') as f_in:
-                with open(csv_file_path, 'wb') as f_out:
-                    f_out.write(f_in.read())
-            print(f"Extracted CrUX CSV: {csv_file_path}")
+            if KEEP_EXTRACTED_CSV:
+                with gzip.open(gz_file_path, 'rb') as f_in:
+                    with open(csv_file_path, 'wb') as f_out:
+                        f_out.write(f_in.read())
+                print(f"Extracted CrUX CSV: {csv_file_path}")
 
             global_cache["crux"].add(month_str)
         else:
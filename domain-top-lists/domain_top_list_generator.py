@@ -2,7 +2,155 @@ import pandas as pd
 import numpy as np
 from urllib.parse import urlparse
 import os
-from collections import Counter
+import csv
+import io
+import gzip
+import zipfile
+import time
+from collections import Counter, OrderedDict
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pv
+import pyarrow.parquet as pq
+
+# Same missing-value markers pd.read_csv uses by default, so both loaders drop the same rows
+CSV_NULL_VALUES = ["", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+                   "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null"]
+# Vectorized equivalent of urlparse(...).netloc: optional scheme, then "//" and everything up to the path
+URL_NETLOC_PATTERN = r"^(?:[a-z][a-z0-9+.\-]*:)?//(?P<netloc>[^/?#]*)"
+# Daily list locations (as written by the historical collector) and whether they carry a header row
+DAILY_LIST_SOURCES = {
+    "Tranco": ("historical_data/tranco/tranco-{date}.zip", False),
+    "Umbrella": ("historical_data/umbrella/umbrella-{date}.csv.zip", False),
+    "Majestic": ("historical_data/majestic/majestic-{date}.zip", True),
+}
+# Bytes of (decompressed) CSV parsed per block when streaming archives
+CSV_BLOCK_SIZE = 8 << 20
+# Harmonic sums up to this many terms are computed exactly; beyond it the tail uses Euler–Maclaurin
+HARMONIC_EXACT_LIMIT = 10_000_000
+HARMONIC_HEAD_TERMS = 1_000
+
+class DomainRegistry:
+    """
+    Run-wide dictionary of canonical domains: each domain gets a dense int32 id (its position).
+
+    Stages join, group and filter on the ids; strings are only decoded when output is written.
+    Saved as a dictionary-encoded Parquet column so the prefix stage reuses the same ids.
+    """
+
+    def __init__(self, domains=None):
+        self.base = pa.array([], type=pa.string())  # ids 0..len(base)-1 as an Arrow array (see from_arrow)
+        self.ids = {}  # domain -> id of the domains registered on top of base, grown in place
+        self.names = []  # id - len(base) -> domain
+        self._decoded = np.empty(0, dtype=object)
+        if domains is not None:
+            self.encode(domains)
+
+    @classmethod
+    def from_arrow(cls, dictionary):
+        """
+        Registry over an Arrow string array of distinct domains (e.g. memory-mapped), ids = positions.
+        Nothing is hashed into Python or decoded up front: lookups hash in Arrow, decodes take by id.
+        """
+        registry = cls()
+        registry.base = dictionary
+        return registry
+
+    def __len__(self):
+        return len(self.base) + len(self.names)
+
+    def encode(self, domains):
+        """Return int32 ids for the given domains, registering the ones not seen before."""
+        codes, uniques = pd.factorize(np.asarray(domains, dtype=object), use_na_sentinel=False)
+        ids, names, offset = self.ids, self.names, len(self.base)
+        lookup = np.empty(len(uniques), dtype=np.int32)
+        missing = np.arange(len(uniques))
+        if offset:
+            found = pc.index_in(pa.array(uniques, type=pa.string(), from_pandas=True), value_set=self.base)
+            in_base = found.is_valid().to_numpy(zero_copy_only=False)
+            lookup[in_base] = found.drop_null().to_numpy()
+            missing = missing[~in_base]
+        for position in missing:
+            domain = uniques[position]
+            domain_id = ids.get(domain)
+            if domain_id is None:
+                domain_id = ids[domain] = offset + len(names)
+                names.append(domain)
+            lookup[position] = domain_id
+        return lookup[codes]
+
+    def to_arrow(self):
+        """All registered domains as one Arrow string array, indexed by id."""
+        return pa.concat_arrays([self.base.cast(pa.string()), pa.array(self.names, type=pa.string(), from_pandas=True)])
+
+    def to_numpy(self):
+        """Object array of all registered domains, indexed by id (cached until new ones are added)."""
+        if len(self._decoded) != len(self):
+            self._decoded = self.to_arrow().to_numpy(zero_copy_only=False) if len(self.base) else np.array(self.names, dtype=object)
+        return self._decoded
+
+    def decode(self, ids):
+        ids = np.asarray(ids, dtype=np.int64)
+        if not len(self.base) or len(self._decoded) == len(self):
+            return self.to_numpy()[ids]
+        # Arrow-backed: materialize only the distinct domains asked for
+        distinct, inverse = np.unique(ids, return_inverse=True)
+        in_base = distinct < len(self.base)
+        values = np.empty(len(distinct), dtype=object)
+        values[in_base] = self.base.take(pa.array(distinct[in_base])).to_numpy(zero_copy_only=False)
+        values[~in_base] = [self.names[i] for i in distinct[~in_base] - len(self.base)]
+        return values[inverse]
+
+    def save(self, path):
+        indices = pa.array(np.arange(len(self), dtype=np.int32))
+        pq.write_table(pa.table({"domain": pa.DictionaryArray.from_arrays(indices, self.to_arrow())}), path)
+
+    @classmethod
+    def load(cls, path):
+        column = pq.read_table(path, columns=["domain"]).column("domain").combine_chunks()
+        if pa.types.is_dictionary(column.type):
+            column = column.dictionary_decode()
+        return cls(column.to_numpy(zero_copy_only=False))
+
+# Domains are interned once per run and shared by every stage below
+DOMAIN_REGISTRY = DomainRegistry()
+
+def with_domain_names(df, registry=DOMAIN_REGISTRY):
+    """Decode the domain_id column back to domain strings for writing or printing."""
+    df = df.copy()
+    df.insert(0, "domain", registry.decode(df.pop("domain_id")))
+    return df
+
+def save_domain_top_list(df, path_stem, output_format="csv", registry=DOMAIN_REGISTRY):
+    """
+    Write a DTL (domain_id plus weight/frequency columns) and return the written path.
+
+    - "csv": plain text export with decoded domains (the historical format).
+    - "parquet": zstd-compressed, domain as a dictionary column, domain_id int32, weights float64.
+    - "arrow": uncompressed Arrow IPC file with the same schema, memory-mappable without any decoding.
+    """
+    if output_format == "csv":
+        path = f"{path_stem}.csv"
+        with_domain_names(df, registry).to_csv(path, index=False)
+        return path
+
+    columns = {"domain": pa.array(registry.decode(df["domain_id"]), type=pa.string()).dictionary_encode(),
+               "domain_id": pa.array(df["domain_id"].to_numpy(np.int32))}
+    for col in df.columns.drop("domain_id"):
+        columns[col] = pa.array(df[col].to_numpy())
+    table = pa.table(columns)
+    if output_format == "parquet":
+        path = f"{path_stem}.parquet"
+        pq.write_table(table, path, compression="zstd")
+    elif output_format == "arrow":
+        path = f"{path_stem}.arrow"
+        with pa.ipc.new_file(path, table.schema) as writer:
+            writer.write_table(table)
+    else:
+        raise ValueError(f"Unknown DTL output format: {output_format}")
+    return path
 
 def clean_domain(domain):
     if pd.isna(domain):
@@ -12,8 +160,7 @@ def clean_domain(domain):
     clean_domain = parsed_url.netloc if parsed_url.netloc else domain
     return clean_domain.replace("www.", "")
 
-def load_domain_top_list(filepath, has_header=True):
-    print(f"Loading file: {filepath}")
+def load_domain_top_list_pandas(filepath, has_header=True):
     df = pd.read_csv(filepath, header=0 if has_header else None, dtype=str)
 
     if has_header and "origin" in df.columns and "rank" in df.columns:
@@ -32,125 +179,540 @@ def load_domain_top_list(filepath, has_header=True):
     df["domain"] = df["domain"].apply(clean_domain)
     df["rank"] = pd.to_numeric(df["rank"], errors="coerce").fillna(0).astype(int)
     df = df[["domain", "rank"]].dropna()
-    print(f"→ Loaded {len(df)} entries.")
     return df
 
+def clean_domain_column(domains):
+    """Vectorized clean_domain over an Arrow string array (strip, lowercase, keep netloc, drop "www.")."""
+    domains = pc.utf8_lower(pc.utf8_trim_whitespace(domains))
+    netloc = pc.struct_field(pc.extract_regex(domains, URL_NETLOC_PATTERN), "netloc")
+    has_netloc = pc.fill_null(pc.not_equal(netloc, ""), False)
+    domains = pc.if_else(has_netloc, netloc, domains)
+    return pc.replace_substring(domains, "www.", "")
+
+def open_list_stream(filepath):
+    """Binary stream over a daily list, decompressing the collector's .zip / .gz archives on the fly."""
+    if filepath.endswith(".zip"):
+        archive = zipfile.ZipFile(filepath)
+        members = [n for n in archive.namelist() if n.endswith(".csv")] or archive.namelist()
+        return archive.open(members[0])
+    if filepath.endswith(".gz"):
+        return gzip.open(filepath, "rb")
+    return open(filepath, "rb")
+
+def is_list_archive(filepath):
+    return filepath.endswith((".zip", ".gz"))
+
+def load_domain_top_list_arrow(filepath, has_header=True):
+    """
+    Arrow CSV reader producing the same rows as load_domain_top_list_pandas.
+
+    - Reads the domain and rank columns as string (like dtype=str), with pandas' default null markers.
+    - Resolves the list format with the same rules as the pandas loader.
+    - Cleans domains with Arrow string kernels instead of a per-row urlparse.
+    - Plain CSVs are parsed multithreaded in one go; .zip/.gz archives are decompressed as a stream
+      and parsed block by block, so memory stays bounded by the block size plus the two kept columns.
+    """
+    with open_list_stream(filepath) as stream:
+        first_row = next(csv.reader(io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")), [])
+    columns = first_row if has_header else [f"f{i}" for i in range(len(first_row))]
+
+    if has_header and "origin" in columns and "rank" in columns:
+        domain_col, rank_col = "origin", "rank"
+    elif not has_header and len(columns) == 2 and first_row[0].isdigit():
+        domain_col, rank_col = columns[1], columns[0]
+    elif has_header and len(columns) == 2 and columns[0] == 'domain':
+        domain_col, rank_col = columns[0], columns[1]
+    elif has_header and "GlobalRank" in columns and "Domain" in columns:
+        domain_col, rank_col = "Domain", "GlobalRank"
+    elif has_header and len(columns) == 1 and columns[0] == "domain":
+        domain_col, rank_col = "domain", None
+    else:
+        raise ValueError(f"Unknown format in file: {filepath}")
+
+    keep_columns = [domain_col] if rank_col is None else [domain_col, rank_col]
+    read_options = pv.ReadOptions(use_threads=True, column_names=columns, skip_rows=1 if has_header else 0,
+                                  block_size=CSV_BLOCK_SIZE)
+    convert_options = pv.ConvertOptions(
+        column_types={name: pa.string() for name in keep_columns},
+        include_columns=keep_columns,
+        null_values=CSV_NULL_VALUES,
+        strings_can_be_null=True,
+    )
+    if is_list_archive(filepath):
+        domains, ranks = [], []
+        with open_list_stream(filepath) as stream:
+            for batch in pv.open_csv(stream, read_options=read_options, convert_options=convert_options):
+                domains.append(clean_domain_column(batch.column(domain_col)))
+                if rank_col is not None:
+                    ranks.append(batch.column(rank_col))
+        domains = pa.chunked_array(domains, type=pa.string())
+        ranks = pa.chunked_array(ranks, type=pa.string()) if rank_col is not None else None
+    else:
+        table = pv.read_csv(filepath, read_options=read_options, convert_options=convert_options)
+        domains = clean_domain_column(table.column(domain_col))
+        ranks = table.column(rank_col) if rank_col is not None else None
+
+    df = pd.DataFrame({"domain": domains.to_pandas()})
+    if ranks is None:
+        df["rank"] = 0  # Placeholder
+    else:
+        df["rank"] = pd.to_numeric(ranks.to_pandas(), errors="coerce").fillna(0).astype(int)
+    return df.dropna()
+
+def load_domain_top_list(filepath, has_header=True, engine="arrow"):
+    """Load one daily top list as (domain, rank); engine is "arrow" (default) or "pandas" (legacy per-row path)."""
+    print(f"Loading file: {filepath}")
+    start = time.perf_counter()
+    if engine == "arrow":
+        df = load_domain_top_list_arrow(filepath, has_header=has_header)
+    elif engine == "pandas":
+        df = load_domain_top_list_pandas(filepath, has_header=has_header)
+    else:
+        raise ValueError(f"Unknown loader engine: {engine}")
+    elapsed = max(time.perf_counter() - start, 1e-9)
+    print(f"→ Loaded {len(df)} entries ({len(df) / elapsed:,.0f} rows/s).")
+    return df
+
+def euler_maclaurin_tail(a, b, s=1.0):
+    """Approximate sum_{k=a}^{b} k^-s with the Euler–Maclaurin formula (error ~ a^(-s-5))."""
+    if s == 1.0:
+        integral = np.log(b / a)
+    else:
+        integral = (b ** (1 - s) - a ** (1 - s)) / (1 - s)
+    endpoints = (a ** -s + b ** -s) / 2
+    first_derivative = -s * (b ** (-s - 1) - a ** (-s - 1)) / 12
+    third_derivative = s * (s + 1) * (s + 2) * (b ** (-s - 3) - a ** (-s - 3)) / 720
+    return integral + endpoints + first_derivative + third_derivative
+
+@lru_cache(maxsize=None)
 def precompute_harmonic_sum(total_elements, s=1.0):
-    return np.sum(1 / (np.arange(1, total_elements + 1) ** s))
+    """Generalized harmonic number H(N, s), memoized per (N, s)."""
+    if total_elements <= HARMONIC_EXACT_LIMIT:
+        return np.sum(1 / (np.arange(1, total_elements + 1) ** s))
+    head = np.sum(1 / (np.arange(1, HARMONIC_HEAD_TERMS) ** s))
+    return head + euler_maclaurin_tail(HARMONIC_HEAD_TERMS, total_elements, s)
+
+@lru_cache(maxsize=16)
+def zipf_weight_table(total_elements, s=1.0, max_rank=None):
+    """
+    Read-only Zipf weights indexed by rank: table[r] = r^-s / H(N, s), for r in 0..max(N, max_rank).
+
+    Rank 0 (the placeholder for unranked lists) maps to inf, like 1 / 0**s did before.
+    """
+    size = max(total_elements, max_rank or 0)
+    table = np.empty(size + 1)
+    table[0] = np.inf
+    table[1:] = (1 / (np.arange(1, size + 1) ** s)) / precompute_harmonic_sum(total_elements, s)
+    table.flags.writeable = False
+    return table
 
 def apply_zipf_weighting(df, s=1.0):
     total_entries = len(df)
     print(f"Applying Zipf weights to {total_entries} domains...")
-    harmonic_sum = precompute_harmonic_sum(total_entries, s)
     df = df.copy()
-    df["weight"] = (1 / (df["rank"] ** s)) / harmonic_sum
+    ranks = df["rank"].to_numpy()
+    if total_entries and ranks.min() >= 0:
+        df["weight"] = zipf_weight_table(total_entries, s, int(ranks.max()))[ranks]
+    else:
+        df["weight"] = (1 / (df["rank"] ** s)) / precompute_harmonic_sum(total_entries, s)
     print(f"→ Zipf weighting complete (weight sum = {df['weight'].sum():.4f})")
     return df
 
-def process_dataset(name, filepaths, has_header=True, is_rolling=False, use_weight=True):
-    print(f"\n=== Processing {name} Dataset ===")
-    df_list = []
-    rank_tracker = {}
+def compute_rank_statistics(df_list):
+    """
+    Per-domain rank statistics across the daily lists of one source, via a single grouped aggregation.
 
-    for path in filepaths:
-        df = load_domain_top_list(path, has_header=has_header)
+    Returns one row per domain with best_rank, worst_rank, mean_rank and days_present
+    (number of daily lists the domain appears in), sorted by best rank.
+    """
+    ranks = pd.concat(
+        [df[["domain_id", "rank"]].assign(day=i) for i, df in enumerate(df_list)],
+        ignore_index=True,
+    )
+    stats = ranks.groupby("domain_id", as_index=False).agg(
+        best_rank=("rank", "min"),
+        worst_rank=("rank", "max"),
+        mean_rank=("rank", "mean"),
+        days_present=("day", "nunique"),
+    )
+    return stats.sort_values(["best_rank", "mean_rank"], kind="stable").reset_index(drop=True)
+
+def load_weighted_day(path, has_header=True, use_weight=True, registry=DOMAIN_REGISTRY):
+    """Load one daily list as (domain_id, rank, weight) with its Zipf (or dummy) weights."""
+    df = load_domain_top_list(path, has_header=has_header)
+    df = pd.DataFrame({"domain_id": registry.encode(df["domain"]), "rank": df["rank"].to_numpy()})
 
-        if use_weight:
-            if df["rank"].nunique() > 1:
-                df = apply_zipf_weighting(df)
-            else:
-                df["weight"] = 1 / len(df)
+    if use_weight:
+        if df["rank"].nunique() > 1:
+            df = apply_zipf_weighting(df)
         else:
-            df["weight"] = 1.0  # Assign dummy weight
+            df["weight"] = 1 / len(df)
+    else:
+        df["weight"] = 1.0  # Assign dummy weight
+    return df
+
+def load_weighted_day_compact(path, has_header=True, use_weight=True):
+    """
+    Process-pool half of load_weighted_day: weights one file against a private registry and returns
+    compact arrays (local domain dictionary, int32 codes, ranks, weights) instead of a DataFrame.
+    """
+    local_registry = DomainRegistry()
+    df = load_weighted_day(path, has_header, use_weight, local_registry)
+    dictionary = local_registry.to_arrow()
+    return dictionary, df["domain_id"].to_numpy(), df["rank"].to_numpy(), df["weight"].to_numpy()
+
+def load_weighted_days(jobs, workers=1, registry=DOMAIN_REGISTRY):
+    """
+    Load and weight many daily files, given as (path, has_header, use_weight) jobs.
 
-        df_list.append(df)
-        for _, row in df.iterrows():
-            rank_tracker.setdefault(row["domain"], []).append(row.get("rank", None))
+    With workers > 1 the files are processed concurrently in a process pool; results are interned
+    into the shared registry in job order, so domain ids match a sequential run.
+    """
+    if workers <= 1:
+        return [load_weighted_day(path, has_header, use_weight, registry) for path, has_header, use_weight in jobs]
+
+    df_list = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(load_weighted_day_compact, *job) for job in jobs]
+        for future in futures:
+            dictionary, codes, ranks, weights = future.result()
+            domain_ids = registry.encode(dictionary.to_numpy(zero_copy_only=False))[codes]
+            df_list.append(pd.DataFrame({"domain_id": domain_ids, "rank": ranks, "weight": weights}))
+    return df_list
+
+def process_dataset(name, filepaths, has_header=True, is_rolling=False, use_weight=True, save_rank_stats=False,
+                    registry=DOMAIN_REGISTRY, output_format="csv", workers=1, df_list=None):
+    print(f"\n=== Processing {name} Dataset ===")
+    if df_list is None:
+        df_list = load_weighted_days([(path, has_header, use_weight) for path in filepaths], workers, registry)
+
+    rank_stats = compute_rank_statistics(df_list)
 
     # Merge weights or just deduplicate domains
     if use_weight:
         if len(df_list) > 1:
             df = pd.concat(df_list)
-            df = df.groupby("domain", as_index=False)["weight"].mean()
+            df = df.groupby("domain_id", as_index=False)["weight"].mean()
         else:
             df = df_list[0]
 
         df["final_weight"] = df["weight"] / df["weight"].sum()
-        df = df[["domain", "final_weight"]]
+        df = df[["domain_id", "final_weight"]]
         df = df.sort_values("final_weight", ascending=False).reset_index(drop=True)
     else:
-        df = pd.concat(df_list).drop_duplicates(subset="domain")
-        df = df[["domain"]].reset_index(drop=True)
+        df = pd.concat(df_list).drop_duplicates(subset="domain_id")
+        df = df[["domain_id"]].reset_index(drop=True)
         df["final_weight"] = np.nan  # Placeholder, not used
 
     # Output
     global out_dir
     os.makedirs(out_dir, exist_ok=True)
-    df.to_csv(f"{out_dir}/domain_top_list_{name.lower().replace(' ', '_')}.csv", index=False)
-    print(f"→ Saved to: {out_dir}/domain_top_list_{name.lower().replace(' ', '_')}.csv\n")
-    
+    output_path = save_domain_top_list(df, f"{out_dir}/domain_top_list_{name.lower().replace(' ', '_')}", output_format, registry)
+    print(f"→ Saved to: {output_path}\n")
+    if save_rank_stats:
+        stats_path = f"{out_dir}/domain_rank_stats_{name.lower().replace(' ', '_')}.csv"
+        with_domain_names(rank_stats, registry).to_csv(stats_path, index=False)
+        print(f"→ Saved rank statistics to: {stats_path}\n")
+
     # Top 10 domains
-    df_top10 = df.head(10).copy()
-    df_top10["rank"] = range(1, 11)
-    df_top10["top_rank"] = df_top10["domain"].apply(lambda d: min(rank_tracker.get(d, [None])))
-    df_top10["bottom_rank"] = df_top10["domain"].apply(lambda d: max(rank_tracker.get(d, [None])))
-    df_top10 = df_top10[["rank", "domain", "final_weight", "top_rank", "bottom_rank"]]
+    df_top10 = with_domain_names(df.head(10).merge(rank_stats, on="domain_id", how="left"), registry)
+    df_top10.insert(0, "rank", range(1, len(df_top10) + 1))
+    df_top10 = df_top10[["rank", "domain", "final_weight", "best_rank", "worst_rank", "days_present"]]
     print(df_top10.to_string(index=False))
     return df
 
-def merge_and_average_zipf_weights(df_list):
+def process_datasets_parallel(datasets, workers, save_rank_stats=False, registry=DOMAIN_REGISTRY, output_format="csv"):
     """
-    Merges multiple domain ranking lists, ensures unique domains before merging,
-    then computes the average Zipf weight and normalizes.
+    Build several per-source DTLs at once: every daily file of every source is loaded and weighted
+    in one process pool, then each source is merged as in process_dataset.
 
-    - Renames each weight column (weight_0, weight_1, etc.) before merging.
-    - Uses an outer join to include all domains from all sources.
-    - Fills missing weights with 0.
-    - Computes average across available weights.
-    - Normalizes so final_weight sums to 1.
+    datasets: list of dicts with keys name, filepaths and optionally has_header / use_weight.
+    """
+    jobs, bounds = [], []
+    for dataset in datasets:
+        start = len(jobs)
+        jobs += [(path, dataset.get("has_header", True), dataset.get("use_weight", True)) for path in dataset["filepaths"]]
+        bounds.append((start, len(jobs)))
+
+    start_time = time.perf_counter()
+    df_list = load_weighted_days(jobs, workers, registry)
+    print(f"→ Loaded {len(jobs)} files with {workers} workers in {time.perf_counter() - start_time:.1f}s")
+
+    return [
+        process_dataset(dataset["name"], dataset["filepaths"], has_header=dataset.get("has_header", True),
+                        use_weight=dataset.get("use_weight", True), save_rank_stats=save_rank_stats,
+                        registry=registry, output_format=output_format, df_list=df_list[start:end])
+        for dataset, (start, end) in zip(datasets, bounds)
+    ]
+
+class RollingDomainWindow:
+    """
+    Incremental DTL for a daily-sliding window of one source.
+
+    Keeps the per-day partials (weight sum and row count per domain id) and running totals over
+    the window. Advancing adds the new day and subtracts the expired one, so only the new file is
+    parsed; the DTL (mean weight per domain, normalized) matches process_dataset within float tolerance.
+    """
+
+    def __init__(self, name, window_days=7, has_header=True, use_weight=True, registry=DOMAIN_REGISTRY):
+        self.name = name
+        self.window_days = window_days
+        self.has_header = has_header
+        self.use_weight = use_weight
+        self.registry = registry
+        self.days = {}  # "YYYYMMDD" -> (domain_ids, weight_sums, row_counts), oldest first
+        self.changed = set()  # Days whose partials differ from the saved day_<day>.parquet
+        self.weight_sum = np.zeros(0)
+        self.row_count = np.zeros(0, dtype=np.int64)
+
+    def _apply(self, partial, sign):
+        domain_ids, weight_sums, row_counts = partial
+        size = int(domain_ids.max()) + 1 if len(domain_ids) else 0
+        if size > len(self.weight_sum):
+            self.weight_sum = np.concatenate([self.weight_sum, np.zeros(size - len(self.weight_sum))])
+            self.row_count = np.concatenate([self.row_count, np.zeros(size - len(self.row_count), dtype=np.int64)])
+        self.weight_sum[domain_ids] += sign * weight_sums
+        self.row_count[domain_ids] += sign * row_counts
+
+    def add_day(self, day, filepath):
+        day = pd.Timestamp(day).strftime("%Y%m%d")
+        if day in self.days:
+            self.remove_day(day)
+        df = load_weighted_day(filepath, self.has_header, self.use_weight, self.registry)
+        daily = df.groupby("domain_id")["weight"].agg(["sum", "count"])
+        partial = (daily.index.to_numpy(np.int32), daily["sum"].to_numpy(), daily["count"].to_numpy(np.int64))
+        self.days[day] = partial
+        self.changed.add(day)
+        self._apply(partial, +1)
+
+    def remove_day(self, day):
+        self._apply(self.days.pop(pd.Timestamp(day).strftime("%Y%m%d")), -1)
+        # Domains that left the window are exactly zero, not float residue
+        self.weight_sum[self.row_count == 0] = 0.0
+
+    def advance(self, day, filepath):
+        """Add one day and drop the days older than window_days calendar days (missing days count too)."""
+        self.add_day(day, filepath)
+        first_day = (pd.Timestamp(day) - pd.Timedelta(days=self.window_days - 1)).strftime("%Y%m%d")
+        for expired in [d for d in sorted(self.days) if d < first_day]:
+            print(f"→ Dropping expired day {expired} from {self.name} window")
+            self.remove_day(expired)
+        return self.to_dtl()
+
+    def to_dtl(self):
+        present = np.flatnonzero(self.row_count > 0)
+        df = pd.DataFrame({"domain_id": present.astype(np.int32)})
+        if self.use_weight:
+            mean_weight = self.weight_sum[present] / self.row_count[present]
+            df["final_weight"] = mean_weight / mean_weight.sum()
+            df = df.sort_values("final_weight", ascending=False).reset_index(drop=True)
+        else:
+            df["final_weight"] = np.nan  # Placeholder, not used
+        return df
+
+    def save(self, state_dir):
+        """Persist the per-day partials and running totals (domains stored as strings)."""
+        os.makedirs(state_dir, exist_ok=True)
+        for fname in os.listdir(state_dir):
+            if fname.startswith("day_") and fname[4:12] not in self.days:
+                os.remove(os.path.join(state_dir, fname))
+        for day, (domain_ids, weight_sums, row_counts) in self.days.items():
+            day_path = os.path.join(state_dir, f"day_{day}.parquet")
+            if day in self.changed or not os.path.exists(day_path):
+                pd.DataFrame({"domain": self.registry.decode(domain_ids), "weight_sum": weight_sums,
+                              "row_count": row_counts}).to_parquet(day_path, index=False)
+        present = np.flatnonzero(self.row_count > 0)
+        pd.DataFrame({"domain": self.registry.decode(present), "weight_sum": self.weight_sum[present],
+                      "row_count": self.row_count[present]}).to_parquet(os.path.join(state_dir, "running.parquet"), index=False)
+        self.changed.clear()
+
+    @classmethod
+    def load(cls, state_dir, name, **kwargs):
+        window = cls(name, **kwargs)
+        if not os.path.exists(os.path.join(state_dir, "running.parquet")):
+            return window
+        for fname in sorted(os.listdir(state_dir)):
+            if fname.startswith("day_"):
+                day_df = pd.read_parquet(os.path.join(state_dir, fname))
+                window.days[fname[4:12]] = (window.registry.encode(day_df["domain"]),
+                                            day_df["weight_sum"].to_numpy(), day_df["row_count"].to_numpy(np.int64))
+        running = pd.read_parquet(os.path.join(state_dir, "running.parquet"))
+        window._apply((window.registry.encode(running["domain"]), running["weight_sum"].to_numpy(),
+                       running["row_count"].to_numpy(np.int64)), +1)
+        return window
+
+def process_dataset_incremental(name, day, filepath, state_dir, window_days=7, has_header=True, use_weight=True,
+                                registry=DOMAIN_REGISTRY, output_format="csv"):
+    """Advance the persisted rolling window of one source by a single day and write its DTL."""
+    print(f"\n=== Advancing {name} Window to {pd.Timestamp(day).date()} ===")
+    window = RollingDomainWindow.load(state_dir, name, window_days=window_days, has_header=has_header,
+                                      use_weight=use_weight, registry=registry)
+    df = window.advance(day, filepath)
+    window.save(state_dir)
+
+    global out_dir
+    os.makedirs(out_dir, exist_ok=True)
+    output_path = save_domain_top_list(df, f"{out_dir}/domain_top_list_{name.lower().replace(' ', '_')}", output_format, registry)
+    print(f"→ Window {min(window.days)}..{max(window.days)} saved to: {output_path}\n")
+    print(with_domain_names(df.head(10), registry).to_string(index=False))
+    return df
+
+class DailyListCache:
     """
+    Size-bounded LRU cache of weighted daily lists, kept as compact (domain_id, rank, weight) arrays.
 
-    # Step 1: Deduplicate within each DataFrame and rename weight column
-    for i, df in enumerate(df_list):
-        df = df.copy()
-        df = df.groupby("domain", as_index=False)["weight"].mean()
-        df.columns = ["domain", f"weight_{i}"]
-        df_list[i] = df
+    Entries are dropped as soon as the batch plan says no later week needs them; the byte budget
+    evicts least-recently-used entries beyond that (an evicted file is re-parsed if needed again).
+    Pinned entries (the files of the week being built) are never evicted, even over budget.
+    """
 
-    # Step 2: Merge all DataFrames on "domain" using outer joins
-    merged_df = df_list[0]
-    for df in df_list[1:]:
-        merged_df = merged_df.merge(df, on="domain", how="outer")
+    def __init__(self, max_bytes=2 << 30, registry=DOMAIN_REGISTRY):
+        self.max_bytes = max_bytes
+        self.registry = registry
+        self.entries = OrderedDict()  # path -> (domain_ids, ranks, weights)
+        self.nbytes = 0
+        self.loads = Counter()
+        self.pinned = set()
+
+    def __contains__(self, path):
+        return path in self.entries
+
+    def get(self, path):
+        self.entries.move_to_end(path)
+        domain_ids, ranks, weights = self.entries[path]
+        return pd.DataFrame({"domain_id": domain_ids, "rank": ranks, "weight": weights})
+
+    def put(self, path, df):
+        self.loads[path] += 1
+        if self.loads[path] > 1:
+            print(f"⚠️ Re-parsing {path}: evicted earlier, consider a larger cache")
+        entry = (df["domain_id"].to_numpy(np.int32), df["rank"].to_numpy(np.int32), df["weight"].to_numpy())
+        self.entries[path] = entry
+        self.nbytes += sum(a.nbytes for a in entry)
+        self.evict()
+
+    def pin(self, paths):
+        """Protect these paths from eviction (replacing the previous pins); evicts down to budget."""
+        self.pinned = set(paths)
+        self.evict()
+
+    def evict(self):
+        for path in [p for p in self.entries if p not in self.pinned]:
+            if self.nbytes <= self.max_bytes:
+                break
+            self.drop(path)
+
+    def drop(self, path):
+        entry = self.entries.pop(path, None)
+        if entry is not None:
+            self.nbytes -= sum(a.nbytes for a in entry)
+
+def build_week_plan(weeks, sources=DAILY_LIST_SOURCES):
+    """
+    Dependency plan for a batch of weeks: the daily files each week needs, and for every file the
+    index of the last week that uses it. Weeks are (start, end) date pairs, processed in start order.
+    """
+    plan, last_use = [], {}
+    for i, (start, end) in enumerate(sorted(weeks, key=lambda w: pd.Timestamp(w[0]))):
+        dates = pd.date_range(start=start, end=end)
+        files = {name: [template.format(date=d.strftime("%Y-%m-%d")) for d in dates]
+                 for name, (template, _) in sources.items()}
+        plan.append((dates, files))
+        for paths in files.values():
+            for path in paths:
+                last_use[path] = i
+    return plan, last_use
+
+def process_weeks_batch(weeks, sources=DAILY_LIST_SOURCES, output_root="../output/domain-top-lists",
+                        cache_bytes=2 << 30, workers=1, output_format="csv", registry=DOMAIN_REGISTRY):
+    """
+    Build the per-source and merged ranked DTLs of many (possibly overlapping) weeks in one run.
 
-    # Step 3: Fill missing weights with 0
-    merged_df.fillna(0, inplace=True)
+    Every daily file is parsed and weighted once (in parallel with workers > 1) and shared
+    through a DailyListCache between the weeks that contain it.
+    """
+    global out_dir
+    plan, last_use = build_week_plan(weeks, sources)
+    unique_files = len(last_use)
+    total_files = sum(len(paths) for _, files in plan for paths in files.values())
+    print(f"Batch plan: {len(plan)} weeks, {total_files} daily lists, {unique_files} unique files")
+
+    cache = DailyListCache(cache_bytes, registry)
+    merged = {}
+    for i, (dates, files) in enumerate(plan):
+        week_id = f"{dates[0].strftime('%Y%m%d')}_to_{dates[-1].strftime('%Y%m%d')}"
+        out_dir = f"{output_root}/{week_id}"
+        os.makedirs(out_dir, exist_ok=True)
+        print(f"\n##### Week {week_id} #####")
+
+        cache.pin(path for paths in files.values() for path in paths)
+        missing = [(path, sources[name][1], True) for name, paths in files.items() for path in paths if path not in cache]
+        for (path, _, _), df in zip(missing, load_weighted_days(missing, workers, registry)):
+            cache.put(path, df)
+
+        dtls = [process_dataset(name, paths, registry=registry, output_format=output_format,
+                                df_list=[cache.get(path) for path in paths])
+                for name, paths in files.items()]
+        merged_df = merge_and_average_zipf_weights(prepare_weighted_merge(*dtls))
+        print(f"→ Merged file saved to: {save_domain_top_list(merged_df, f'{out_dir}/domain_top_list_merged_ranked', output_format, registry)}")
+        registry.save(f"{out_dir}/domain_registry.parquet")
+        merged[week_id] = merged_df
+
+        for paths in files.values():
+            for path in paths:
+                if last_use[path] == i:
+                    cache.drop(path)
+        cache.pin(())
+
+    print(f"\n✅ Batch done: parsed {sum(cache.loads.values())} files for {total_files} daily lists")
+    return merged
 
-    # Step 4: Compute the average of all renamed weight columns
-    weight_columns = [col for col in merged_df.columns if col.startswith("weight_")]
-    merged_df["final_weight"] = merged_df[weight_columns].mean(axis=1)
+def merge_and_average_zipf_weights(df_list):
+    """
+    Merges multiple domain ranking lists, ensures unique domains before merging,
+    then computes the average Zipf weight and normalizes.
 
-    # Step 5: Normalize so the total weight sums to 1
-    merged_df["final_weight"] /= merged_df["final_weight"].sum()
+    - Deduplicates each source and stacks all (domain_id, weight) rows once.
+    - Reduces them with a single grouped sum over all sources.
+    - Missing domains count as weight 0, so the average is the sum divided by the number of sources.
+    - Normalizes so final_weight sums to 1.
+    """
 
-    # Step 6: Keep only the relevant columns
-    merged_df = merged_df[["domain", "final_weight"]]
+    # Step 1: Deduplicate within each DataFrame and stack the per-source weights
+    stacked = pd.concat(
+        [df.groupby("domain_id", as_index=False)["weight"].mean() for df in df_list],
+        ignore_index=True,
+    )
+
+    # Step 2: Sum weights per domain id in one pass (sequential bincount keeps the old summation order)
+    domain_ids = stacked["domain_id"].to_numpy()
+    size = int(domain_ids.max()) + 1 if len(domain_ids) else 0
+    weight_sums = np.bincount(domain_ids, weights=stacked["weight"].fillna(0).to_numpy(), minlength=size)
+    present = np.bincount(domain_ids, minlength=size) > 0
+    del stacked
+
+    # Step 3: Average over all sources, absent sources contributing 0
+    merged_df = pd.DataFrame({
+        "domain_id": np.flatnonzero(present).astype(np.int32),
+        "final_weight": weight_sums[present] / len(df_list),
+    })
+
+    # Step 4: Normalize so the total weight sums to 1
+    merged_df["final_weight"] /= merged_df["final_weight"].sum()
 
-    # Step 7: Sort by descending final weight
+    # Step 5: Sort by descending final weight
     merged_df = merged_df.sort_values("final_weight", ascending=False).reset_index(drop=True)
 
     return merged_df
 
 def flatten_to_unweighted(df):
-    return df[["domain"]].drop_duplicates().reset_index(drop=True)
+    return df[["domain_id"]].drop_duplicates().reset_index(drop=True)
 
 def build_frequency_rank(df_list):
-    all_domains = []
-    for df in df_list:
-        flat_df = flatten_to_unweighted(df)
-        all_domains.extend(flat_df["domain"].tolist())
-
-    freq_counts = Counter(all_domains)
-    result_df = pd.DataFrame(freq_counts.items(), columns=["domain", "frequency"])
+    domain_ids = np.concatenate([flatten_to_unweighted(df)["domain_id"].to_numpy() for df in df_list])
+    freq_counts = np.bincount(domain_ids)
+    present = np.flatnonzero(freq_counts)
+    result_df = pd.DataFrame({"domain_id": present.astype(np.int32), "frequency": freq_counts[present]})
     result_df = result_df.sort_values("frequency", ascending=False).reset_index(drop=True)
     result_df["normalized_frequency"] = result_df["frequency"] / len(df_list)
     return result_df
@@ -159,6 +721,11 @@ def prepare_weighted_merge(*dfs):
     return [df.rename(columns={"final_weight": "weight"}) for df in dfs]
 
 if __name__ == "__main__":
+    # Batch mode: build several (overlapping) weeks in one invocation, parsing every daily file once
+    # process_weeks_batch([("2025-03-24", "2025-03-30"), ("2025-04-01", "2025-04-07"),
+    #                      ("2025-04-07", "2025-04-13"), ("2025-04-14", "2025-04-20")], workers=4)
+    # raise SystemExit
+
     # dates = pd.date_range(start="2025-03-24", end="2025-03-30")
     # dates = pd.date_range(start="2025-04-01", end="2025-04-07")
     # dates = pd.date_range(start="2025-04-07", end="2025-04-13")
@@ -166,24 +733,38 @@ if __name__ == "__main__":
     week_id = f"{dates[0].strftime('%Y%m%d')}_to_{dates[-1].strftime('%Y%m%d')}"
     out_dir = f"../output/domain-top-lists/{week_id}"
     os.makedirs(out_dir, exist_ok=True)
+    output_format = "csv"  # or "parquet" / "arrow" for typed columnar DTLs the prefix stage memory-maps
     start_str = dates[0].strftime("%Y-%m-%d")
     end_str = dates[-1].strftime("%Y-%m-%d")
     print(f"Processing domain top list datasets from {start_str} to {end_str}...")
 
     # 7-day datasets
-    tranco_files = [f"historical_data/tranco/{d.strftime('%Y%m%d')}_tranco.csv" for d in dates]
-    umbrella_files = [f"historical_data/umbrella/{d.strftime('%Y%m%d')}_umbrella.csv" for d in dates]
-    majestic_files = [f"historical_data/majestic/{d.strftime('%Y%m%d')}_majestic.csv" for d in dates]
+    # Read straight from the archives written by the historical collector (extracted CSVs work too)
+    tranco_files = [DAILY_LIST_SOURCES["Tranco"][0].format(date=d.strftime('%Y-%m-%d')) for d in dates]
+    umbrella_files = [DAILY_LIST_SOURCES["Umbrella"][0].format(date=d.strftime('%Y-%m-%d')) for d in dates]
+    majestic_files = [DAILY_LIST_SOURCES["Majestic"][0].format(date=d.strftime('%Y-%m-%d')) for d in dates]
 
     # Uncomment and alter the following lines accordingly to produce DTLs per presence (not only per rank)
     # # Static datasets
-    # crux_file     = ["historical_data/crux/20250401_crux.csv"]
+    # crux_file     = ["historical_data/crux/crux-202504.csv.gz"]
     # radar_file    = ["historical_data/radar/20250407_radar.csv"]
 
     # Run all
-    tranco_dtl = process_dataset("Tranco", tranco_files, has_header=False, is_rolling=True, use_weight=True)
-    umbrella_dtl = process_dataset("Umbrella", umbrella_files, has_header=False, is_rolling=True, use_weight=True)
-    majestic_dtl = process_dataset("Majestic", majestic_files, has_header=True, is_rolling=True, use_weight=True)
+    workers = 1  # > 1 loads and weights all daily files of all sources concurrently in a process pool
+    if workers > 1:
+        tranco_dtl, umbrella_dtl, majestic_dtl = process_datasets_parallel([
+            {"name": "Tranco", "filepaths": tranco_files, "has_header": False},
+            {"name": "Umbrella", "filepaths": umbrella_files, "has_header": False},
+            {"name": "Majestic", "filepaths": majestic_files, "has_header": True},
+        ], workers=workers, output_format=output_format)
+    else:
+        tranco_dtl = process_dataset("Tranco", tranco_files, has_header=False, is_rolling=True, use_weight=True, output_format=output_format)
+        umbrella_dtl = process_dataset("Umbrella", umbrella_files, has_header=False, is_rolling=True, use_weight=True, output_format=output_format)
+        majestic_dtl = process_dataset("Majestic", majestic_files, has_header=True, is_rolling=True, use_weight=True, output_format=output_format)
+    # Daily-sliding alternative: only parse the newest day and update the persisted window state
+    # tranco_dtl = process_dataset_incremental("Tranco", dates[-1], tranco_files[-1], "rolling_state/tranco", has_header=False)
+    # umbrella_dtl = process_dataset_incremental("Umbrella", dates[-1], umbrella_files[-1], "rolling_state/umbrella", has_header=False)
+    # majestic_dtl = process_dataset_incremental("Majestic", dates[-1], majestic_files[-1], "rolling_state/majestic", has_header=True)
     # Uncomment the following lines to produce DTLs per presence (not only per rank)
     # crux_dtl = process_dataset("Crux", crux_file, has_header=True, use_weight=False)   # <== no weighting
     # radar_dtl = process_dataset("Radar", radar_file, has_header=True, use_weight=False) # <== no weighting
@@ -192,8 +773,10 @@ if __name__ == "__main__":
     # df_list = load_processed_domain_lists(["tranco", "umbrella", "majestic"])
     merged_df = merge_and_average_zipf_weights(df_list)
     # Save the result
-    merged_output_path = f"{out_dir}/domain_top_list_merged_ranked.csv"
-    merged_df.to_csv(merged_output_path, index=False)
+    merged_output_path = save_domain_top_list(merged_df, f"{out_dir}/domain_top_list_merged_ranked", output_format)
+    merged_df = with_domain_names(merged_df)
+    # Persist the domain ids so the prefix stage joins on the same integers
+    DOMAIN_REGISTRY.save(f"{out_dir}/domain_registry.parquet")
 
     # Show Top 10
     print("\n=== Merged Top 10 Domains Across Tranco, Umbrella, Majestic ===")
@@ -207,8 +790,8 @@ if __name__ == "__main__":
     freq_merged_df = build_frequency_rank(all_df_list)
 
     # Save the frequency-based merged list
-    freq_output_path = f"{out_dir}/domain_top_list_merged_presence.csv"
-    freq_merged_df.to_csv(freq_output_path, index=False)
+    freq_output_path = save_domain_top_list(freq_merged_df, f"{out_dir}/domain_top_list_merged_presence", output_format)
+    freq_merged_df = with_domain_names(freq_merged_df)
 
     # Print top 10 frequency-ranked domains
     print("\n=== Top Domains by Frequency Across All 5 Sources ===")
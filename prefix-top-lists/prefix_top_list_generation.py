@@ -1,10 +1,29 @@
-import csv
 import json
 import pandas as pd
 from pprint import pprint
 import os
+import sys
+import math
+import shutil
+import socket
+import tempfile
+import ipaddress
 from urllib.parse import urlparse
 import glob
+from collections import namedtuple
+from itertools import chain
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pv
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from scipy import sparse
+
+# Shared with the DTL stage: the domain-id registry it persists next to its outputs
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "domain-top-lists"))
+from domain_top_list_generator import DomainRegistry
 
 # ---------- Helpers ----------
 def write_json(filename, content):
@@ -23,77 +42,289 @@ def canonicalize_domain(domain):
         domain = domain[:-1]
     return domain.replace("www.", "", 1)
 
+def load_weight_table(weight_path):
+    """Open a DTL: Parquet and Arrow IPC files are memory-mapped without text parsing, anything else is read as CSV."""
+    if weight_path.endswith(".parquet"):
+        table = pq.read_table(weight_path, memory_map=True)
+    elif weight_path.endswith((".arrow", ".feather")):
+        table = pa.ipc.open_file(pa.memory_map(weight_path)).read_all()
+    else:
+        return pd.read_csv(weight_path)
+    return table.to_pandas()
+
 # ---------- DNS Processing ----------
-def process_dns_files(dns_filepaths):
-    raw2canon = {}
-    domain2ip, domain2pfx, ip2pfx, pfx2as = {}, {}, {}, {}
+DNS_COLUMNS = ["query_name", "ip4_address", "ip6_address", "ip_prefix", "as"]
+
+def extract_dns_tuples(table):
+    """
+    Vectorized per-row DNS parsing on an Arrow table/batch of OpenINTEL rows:
+    canonical domain, ip (v4 else v6), prefix and AS, dropping rows without ip/prefix/domain or
+    whose prefix is not an address prefix.
+    """
+    column = lambda name: pc.fill_null(table.column(name).cast(pa.string()), "")
+    domain = pc.replace_substring(pc.utf8_rtrim(column("query_name"), characters="."), "www.", "", max_replacements=1)
+    ip4, ip6, pfx = column("ip4_address"), column("ip6_address"), column("ip_prefix")
+    ip = pc.if_else(pc.not_equal(ip4, ""), ip4, ip6)
+    valid = pc.and_(
+        pc.and_(pc.not_equal(ip, ""), pc.not_equal(domain, "")),
+        pc.and_(pc.not_equal(pfx, ""), pc.or_(pc.match_substring(pfx, "."), pc.match_substring(pfx, ":"))),
+    )
+    return pa.table({"domain": domain, "ip": ip, "prefix": pfx, "asn": column("as")}).filter(valid)
+
+DNS_CSV_CONVERT = pv.ConvertOptions(
+    include_columns=DNS_COLUMNS,
+    column_types={name: pa.string() for name in DNS_COLUMNS},
+    null_values=[],
+    strings_can_be_null=False,
+)
+
+def read_dns_file(filepath):
+    """Read one OpenINTEL CSV (optionally .gz) with the columnar engine and return its valid DNS tuples."""
+    print(f"  → Reading: {filepath}")
+    return extract_dns_tuples(pv.read_csv(filepath, convert_options=DNS_CSV_CONVERT))
+
+# Rows need an address and a prefix; evaluated per row group and against Parquet statistics
+DNS_ROW_FILTER = (ds.field("ip_prefix") != "") & ((ds.field("ip4_address") != "") | (ds.field("ip6_address") != ""))
+
+def is_parquet_source(path):
+    return os.path.isdir(path) or path.endswith(".parquet")
 
+def read_dns_parquet(path, batch_size=1 << 20):
+    """
+    Read original OpenINTEL Parquet (a file, or a directory/Hive-partitioned dataset) projecting only
+    the DNS_COLUMNS and pushing DNS_ROW_FILTER down; record batches are streamed into extract_dns_tuples.
+    """
+    print(f"  → Reading: {path}")
+    dataset = ds.dataset(path, format="parquet", partitioning="hive")
+    scanner = dataset.scanner(columns=DNS_COLUMNS, filter=DNS_ROW_FILTER, batch_size=batch_size)
+    tables = [extract_dns_tuples(batch) for batch in scanner.to_batches() if batch.num_rows]
+    if not tables:
+        return extract_dns_tuples(pa.table({name: pa.array([], pa.string()) for name in DNS_COLUMNS}))
+    return pa.concat_tables(tables)
+
+def iter_dns_batches(path, block_size=8 << 20):
+    """Stream the valid DNS tuples of a CSV or Parquet source batch by batch (bounded memory)."""
+    if is_parquet_source(path):
+        dataset = ds.dataset(path, format="parquet", partitioning="hive")
+        batches = dataset.scanner(columns=DNS_COLUMNS, filter=DNS_ROW_FILTER, batch_size=block_size // 64).to_batches()
+    else:
+        batches = pv.open_csv(path, read_options=pv.ReadOptions(block_size=block_size), convert_options=DNS_CSV_CONVERT)
+    for batch in batches:
+        if batch.num_rows:
+            yield extract_dns_tuples(batch)
+
+def read_dns_source(path):
+    return read_dns_parquet(path) if is_parquet_source(path) else read_dns_file(path)
+
+def build_dns_edges(tuples, registry=None, prefix_edges=None):
+    """
+    Build DnsEdges from (domain, ip, prefix, asn) tuples in linear time: each mapping is the
+    first-seen-ordered set of distinct pairs, found by hashing instead of list membership tests.
+    prefix_edges: (ip_pfx, pfx_as) already built over a larger set of tuples (see propagate_shard).
+    """
+    registry = registry if registry is not None else DomainRegistry()
+    if prefix_edges is not None:
+        tuples = tuples.select(["domain", "ip"]) if isinstance(tuples, pa.Table) else tuples[["domain", "ip"]]
+    df = tuples.to_pandas() if isinstance(tuples, pa.Table) else tuples
+    domain_ip = df[["domain", "ip"]].drop_duplicates()
+    ip_pfx, pfx_as = prefix_edges if prefix_edges is not None else dns_prefix_edges(df)
+
+    # Intern each distinct domain once; domain2pfx keys were canonicalized a second time
+    domain_codes, domains = pd.factorize(domain_ip["domain"])
+    domain_ids = registry.encode(domains)
+    alias_ids = registry.encode([canonicalize_domain(d) for d in domains])
+    print(f"\n✅ Parsed: {len(domains)} domains, {ip_pfx['ip'].nunique()} IPs, {pfx_as['prefix'].nunique()} prefixes with AS info")
+    return DnsEdges(
+        domain_ip=pd.DataFrame({"domain_id": domain_ids[domain_codes], "ip": domain_ip["ip"].to_numpy(dtype=object)}),
+        ip_pfx=ip_pfx,
+        pfx_as=pfx_as,
+        domain_ids=pd.unique(alias_ids),
+    )
+
+def dns_prefix_edges(tuples):
+    """Distinct (ip, prefix) and (prefix, asn) pairs of DNS tuples (an Arrow table or DataFrame), in first-seen order."""
+    if isinstance(tuples, pa.Table):
+        distinct = lambda table, keys: table.select(keys).group_by(keys, use_threads=False).aggregate([]).select(keys).to_pandas()
+        return (distinct(tuples, ["ip", "prefix"]),
+                distinct(tuples.filter(pc.not_equal(tuples.column("asn"), "")), ["prefix", "asn"]))
+    return (tuples[["ip", "prefix"]].drop_duplicates().reset_index(drop=True),
+            tuples.loc[tuples["asn"] != "", ["prefix", "asn"]].drop_duplicates().reset_index(drop=True))
+
+def load_dns_edges(dns_filepaths, registry=None, workers=4):
+    """
+    Parse CSV or Parquet DNS sources in parallel threads,
+    then build DnsEdges.
+    """
     print("\n🔍 Processing DNS resolution files...")
-    for filepath in dns_filepaths:
-        print(f"  → Reading: {filepath}")
-        with open(filepath, 'r') as csvfile:
-            reader = csv.DictReader(csvfile)
-            for row in reader:
-                raw_domain = row['query_name'].rstrip('.')
-                canon_domain = canonicalize_domain(raw_domain)
-                raw2canon[raw_domain] = canon_domain
-                ip = row['ip4_address'] or row['ip6_address']
-                pfx = row['ip_prefix']
-                asn = row['as']
-
-                if not ip or not pfx or not canon_domain or (not pfx.count('.') and not ':' in pfx):
-                    continue
-
-                # domain = domain.strip().lower()  # Removed because canon_domain is now used throughout
-                domain2ip.setdefault(canon_domain, []).append(ip) if ip not in domain2ip.get(canon_domain, []) else None
-                domain2pfx.setdefault(canon_domain, []).append(pfx) if pfx not in domain2pfx.get(canon_domain, []) else None
-                ip2pfx.setdefault(ip, []).append(pfx) if pfx not in ip2pfx.get(ip, []) else None
-                pfx2as.setdefault(pfx, set()).add(asn) if asn else None
-
-    print(f"\n✅ Parsed: {len(domain2ip)} domains, {len(ip2pfx)} IPs, {len(pfx2as)} prefixes with AS info")
-
-    # Build alias mapping to canonical domains
-    domain2pfx_canon = {}
-    for domain, pfxes in domain2pfx.items():
-        canon = canonicalize_domain(domain)
-        domain2pfx_canon.setdefault(canon, []).extend(pfxes)
-
-    ip2pfx = {ip: list(set(pfxes)) for ip, pfxes in ip2pfx.items()}
-    return domain2ip, domain2pfx_canon, ip2pfx, pfx2as
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        tables = list(executor.map(read_dns_source, dns_filepaths))
+    return build_dns_edges(pa.concat_tables(tables), registry=registry)
+
+# ---------- DNS Mapping Index ----------
+# Per-week build-once artifact: CSR integer arrays (.npy) over string dictionaries (Arrow IPC),
+# both memory-mapped on load so every PTL/ATL run or analysis shares the same pages.
+DNS_INDEX_EDGES = {"domain_ip": ("domain_id", "ip"), "ip_pfx": ("ip", "prefix"), "pfx_as": ("prefix", "asn")}
+
+# DNS mapping as CSR (indptr, indices) pairs over integer codes: domain_ip (domain id -> ip codes),
+# ip_pfx (ip code -> prefix codes), pfx_as (prefix code -> asn codes), plus the ids of all domains with
+# DNS data and the ips/prefixes/asns dictionaries (object arrays, or memory-mapped Arrow arrays).
+DnsIndex = namedtuple("DnsIndex", ["domain_ip", "ip_pfx", "pfx_as", "domain_ids", "ips", "prefixes", "asns"])
+
+def _to_csr(keys, values, size):
+    """indptr/indices of (key, value) code pairs; each key keeps its values in edge table order."""
+    order = np.argsort(keys, kind="stable")
+    indptr = np.concatenate([[0], np.cumsum(np.bincount(keys, minlength=size))]).astype(np.int64)
+    return indptr, values[order].astype(np.int32)
+
+def _shared_codes(*columns):
+    """Codes of several string columns against one sorted dictionary."""
+    codes, dictionary = pd.factorize(pd.concat([pd.Series(c, dtype=object) for c in columns], ignore_index=True), sort=True)
+    bounds = np.cumsum([0] + [len(c) for c in columns])
+    return [codes[a:b] for a, b in zip(bounds[:-1], bounds[1:])], np.asarray(dictionary, dtype=object)
+
+def _write_dictionary(path, values):
+    values = values.cast(pa.string()) if isinstance(values, pa.Array) else pa.array(values, type=pa.string())
+    with pa.OSFile(path, "wb") as sink, pa.ipc.new_file(sink, pa.schema([("value", pa.string())])) as writer:
+        writer.write_table(pa.table({"value": values}))
+
+def _read_dictionary(path):
+    """The memory-mapped Arrow string array of a dictionary file (no copy, no Python strings)."""
+    return pa.ipc.open_file(pa.memory_map(path, "r")).read_all().column("value").combine_chunks()
+
+def _labels(dictionary, codes):
+    """Strings of codes into a dictionary (object or Arrow array); from Arrow each distinct value is decoded once."""
+    codes = np.asarray(codes, dtype=np.int64)
+    if not isinstance(dictionary, pa.Array):
+        return np.asarray(dictionary, dtype=object)[codes]
+    distinct, inverse = np.unique(codes, return_inverse=True)
+    return dictionary.take(pa.array(distinct)).to_numpy(zero_copy_only=False)[inverse]
+
+def dns_source_name(path):
+    """Basename of a DNS file; for a Hive partition folder its partition path (source=.../day=...), as its basename (day=...) is not unique."""
+    parts = os.path.normpath(path).split(os.sep)
+    partitions = [part for part in parts if "=" in part]
+    return "/".join(partitions) if os.path.isdir(path) and partitions else parts[-1]
+
+def dns_source_files(path):
+    """[relative path, size, mtime_ns] of a DNS file, or of every file under a partition folder (parts added later included)."""
+    if not os.path.isdir(path):
+        stat = os.stat(path)
+        return [[os.path.basename(path), stat.st_size, stat.st_mtime_ns]]
+    files = sorted(f for f in glob.glob(os.path.join(path, "**", "*"), recursive=True) if os.path.isfile(f))
+    return [[os.path.relpath(f, path), os.stat(f).st_size, os.stat(f).st_mtime_ns] for f in files]
+
+def save_dns_index(edges, index_dir, registry, dns_filepaths=()):
+    """Persist DnsEdges and the domain dictionary they refer to as a memory-mappable index."""
+    os.makedirs(index_dir, exist_ok=True)
+    (domain_ip_ip, ip_pfx_ip), ips = _shared_codes(edges.domain_ip["ip"], edges.ip_pfx["ip"])
+    (ip_pfx_pfx, pfx_as_pfx), prefixes = _shared_codes(edges.ip_pfx["prefix"], edges.pfx_as["prefix"])
+    (pfx_as_asn,), asns = _shared_codes(edges.pfx_as["asn"])
+    csr = {
+        "domain_ip": _to_csr(edges.domain_ip["domain_id"].to_numpy(), domain_ip_ip, len(registry)),
+        "ip_pfx": _to_csr(ip_pfx_ip, ip_pfx_pfx, len(ips)),
+        "pfx_as": _to_csr(pfx_as_pfx, pfx_as_asn, len(prefixes)),
+    }
+    for name, (indptr, indices) in csr.items():
+        np.save(os.path.join(index_dir, f"{name}.indptr.npy"), indptr)
+        np.save(os.path.join(index_dir, f"{name}.indices.npy"), indices)
+    np.save(os.path.join(index_dir, "domain_ids.npy"), np.asarray(edges.domain_ids, dtype=np.int32))
+    for name, values in (("domains", registry.to_arrow()), ("ips", ips), ("prefixes", prefixes), ("asns", asns)):
+        _write_dictionary(os.path.join(index_dir, f"{name}.arrow"), values)
+    write_json(os.path.join(index_dir, "meta.json"), {
+        "dns_files": [dns_source_name(f) for f in dns_filepaths],
+        "dns_file_stats": [dns_source_files(f) for f in dns_filepaths],
+        "counts": {name: len(indices) for name, (_, indices) in csr.items()},
+    })
+    print(f"💾 Saved DNS mapping index: {index_dir}")
+
+def load_dns_index(index_dir):
+    """
+    Memory-map a saved DNS mapping index. Returns (DnsIndex, DomainRegistry): the CSR arrays and the
+    Arrow dictionaries stay mapped, so propagation reads the shared pages and strings are only decoded
+    for the values that end up in an output.
+    """
+    load = lambda name: np.load(os.path.join(index_dir, f"{name}.npy"), mmap_mode="r")
+    dictionaries = {name: _read_dictionary(os.path.join(index_dir, f"{name}.arrow")) for name in ("domains", "ips", "prefixes", "asns")}
+    index = DnsIndex(
+        **{name: (load(f"{name}.indptr"), load(f"{name}.indices")) for name in DNS_INDEX_EDGES},
+        domain_ids=load("domain_ids"), ips=dictionaries["ips"], prefixes=dictionaries["prefixes"], asns=dictionaries["asns"],
+    )
+    print(f"📂 Loaded DNS mapping index: {index_dir}")
+    return index, DomainRegistry.from_arrow(dictionaries["domains"])
+
+def dns_index_edges(index):
+    """Expand a DnsIndex into DnsEdges tables (for the routing-table remap, which works on IP strings)."""
+    dictionaries = {"domain_id": None, "ip": index.ips, "prefix": index.prefixes, "asn": index.asns}
+    tables = {}
+    for name, (key, value) in DNS_INDEX_EDGES.items():
+        indptr, indices = getattr(index, name)
+        keys = np.repeat(np.arange(len(indptr) - 1, dtype=np.int32), np.diff(indptr))
+        tables[name] = pd.DataFrame({
+            key: keys if dictionaries[key] is None else _labels(dictionaries[key], keys),
+            value: _labels(dictionaries[value], indices),
+        })
+    return DnsEdges(domain_ids=index.domain_ids, **tables)
+
+def edges_to_index(edges, num_domains):
+    """In-memory DnsIndex of DnsEdges: codes in first-seen order, each key's values in edge table order."""
+    domain_ip, ip_pfx, pfx_as = edges.domain_ip, edges.ip_pfx, edges.pfx_as
+    ip_codes, ips = pd.factorize(pd.concat([ip_pfx["ip"], domain_ip["ip"]], ignore_index=True))
+    pfx_codes, prefixes = pd.factorize(pd.concat([ip_pfx["prefix"], pfx_as["prefix"]], ignore_index=True))
+    asn_codes, asns = pd.factorize(pfx_as["asn"])
+    return DnsIndex(
+        domain_ip=_to_csr(domain_ip["domain_id"].to_numpy(), ip_codes[len(ip_pfx):], num_domains),
+        ip_pfx=_to_csr(ip_codes[:len(ip_pfx)], pfx_codes[:len(ip_pfx)], len(ips)),
+        pfx_as=_to_csr(pfx_codes[len(ip_pfx):], asn_codes, len(prefixes)),
+        domain_ids=edges.domain_ids,
+        ips=np.asarray(ips, dtype=object), prefixes=np.asarray(prefixes, dtype=object), asns=np.asarray(asns, dtype=object),
+    )
+
+def dns_index_matches(index_dir, dns_filepaths):
+    """True if index_dir holds an index built from exactly these DNS files, unchanged (same size and mtime) since."""
+    meta_path = os.path.join(index_dir, "meta.json")
+    if not os.path.exists(meta_path):
+        return False
+    meta = read_json(meta_path)
+    return (meta["dns_files"] == [dns_source_name(f) for f in dns_filepaths]
+            and meta.get("dns_file_stats") == [dns_source_files(f) for f in dns_filepaths])
 
 # ---------- Weight Distribution ----------
-def distribute_weights(domain2pfx, ip2pfx, pfx2as, weight_csv_path, output_pfx_path, output_as_path, is_frequency=False, domain2ip=None):
+def load_matched_weights(weight_csv_path, edges, registry, is_frequency=False):
+    """Load a DTL weight column, keep the rows whose domain is in the DNS mapping and normalize them."""
     print(f"\n📊 Distributing weights from: {weight_csv_path}")
-    df = pd.read_csv(weight_csv_path)
+    df = load_weight_table(weight_csv_path)
     if not is_frequency: print(f"🧮 Total weight before filtering: {df['final_weight'].sum():.6f}")
     weight_col = "final_weight" if not is_frequency else "frequency"
     if weight_col not in df.columns:
         raise ValueError(f"Missing expected column '{weight_col}' in {weight_csv_path}")
 
     df = df.rename(columns={weight_col: "weight"})
-    df_orig = pd.read_csv(weight_csv_path)
-    df_orig = df_orig.rename(columns={weight_col: "weight"})
-    df_orig['raw_domain'] = df_orig['domain']
-    df_orig['domain'] = df_orig['domain'].apply(canonicalize_domain)  # Save original for unmatched comparison
-    df['raw_domain'] = df['domain']
-    df['domain'] = df['domain'].apply(canonicalize_domain)
+    # Canonicalize each distinct domain once and reach the rows through the category codes (-1 = missing)
+    raw_domains = df['domain'].astype('category')
+    codes = raw_domains.cat.codes.to_numpy()
+    canon_domains = np.array([canonicalize_domain(d) for d in raw_domains.cat.categories] + [None], dtype=object)
+    df['raw_domain'] = raw_domains
+    df['domain'] = canon_domains[codes]
+    df['domain_id'] = np.append(registry.encode(canon_domains[:-1]), -1)[codes]
+    df_orig = df  # Save original for unmatched comparison
+    dns_domain_ids = edges.domain_ids
 
     # Match and filter
     original_count = len(df)
     print("🔎 Domains in weight file (before filtering):", len(df))
-    print("🔎 Unique domains in DNS mapping:", len(domain2pfx))
-    df = df[df['domain'].isin(domain2pfx)]
+    print("🔎 Unique domains in DNS mapping:", len(dns_domain_ids))
+    df = df[df['domain_id'].isin(dns_domain_ids)]
     print("🔎 Domains remaining after filtering:", len(df))
     matched_count = len(df)
     print(f"ℹ️ Matched {matched_count} of {original_count} domains from weight file to DNS")
-    unmatched = df_orig[~df_orig['domain'].isin(domain2pfx)]
+    unmatched = df_orig[~df_orig['domain_id'].isin(dns_domain_ids)]
     print(f"❌ Unmatched domains: {len(unmatched)}")
     if not unmatched.empty:
         print("🔍 Top unmatched domains by weight:")
         print(unmatched.sort_values(by='weight', ascending=False)[['raw_domain', 'domain', 'weight']].head(10))
 
     # Show top unmatched domains for debugging
-    unmatched = df[~df['domain'].isin(domain2pfx)]
+    unmatched = df[~df['domain_id'].isin(dns_domain_ids)]
     if not unmatched.empty:
         print("🔍 Top unmatched domains:")
         print(unmatched.sort_values(by="weight", ascending=False)[['raw_domain', 'domain', 'weight']].head(10))
@@ -103,65 +334,35 @@ def distribute_weights(domain2pfx, ip2pfx, pfx2as, weight_csv_path, output_pfx_p
         print("ℹ️ Normalizing weights...")
         print(abs(df['weight'].sum() - 1.0))
         df['weight'] = df['weight'] / df['weight'].sum()
+    return df
 
-    pfx_weights, pfx_domains, pfx_ips = {}, {}, {}
-    ip_weights = {}
-    ip2domain = {}
-    for _, row in df.iterrows():
-        domain, weight = row["domain"], row["weight"]
-        ips = domain2ip.get(domain, [])
-        if not ips:
-            continue
-        split_weight = weight / len(ips)
-        for ip in ips:
-            ip_weights[ip] = ip_weights.get(ip, 0) + split_weight
-            ip2domain.setdefault(ip, set()).add(domain)
-
-    for ip, weight in ip_weights.items():
-        prefixes = ip2pfx.get(ip, [])
-        for pfx in prefixes:
-            pfx_weights[pfx] = pfx_weights.get(pfx, 0) + weight
-            pfx_ips.setdefault(pfx, set()).add(ip)
-            pfx_domains.setdefault(pfx, set()).update(ip2domain.get(ip, []))
-
-    for ip, pfxs in ip2pfx.items():
-        for pfx in pfxs:
-            pfx_ips.setdefault(pfx, set()).add(ip)
-
-    df_pfx = pd.DataFrame([
-        {
-            "prefix": pfx,
-            "weight": pfx_weights[pfx],
-            "domains": ", ".join(sorted(pfx_domains[pfx])),
-            "ips": ", ".join(sorted(pfx_ips.get(pfx, set()))),
-            "ases": ", ".join(sorted(pfx2as.get(pfx, set()))) if pfx in pfx2as else ""
-        }
-        for pfx in pfx_weights
-    ]).sort_values(by="weight", ascending=False)
+def distribute_weights(edges, registry, weight_csv_path, output_pfx_path, output_as_path, is_frequency=False, matcher=None, rollup=False, output_format="csv", top_n=None):
+    """Propagate one DTL weight file through the DNS mapping (DnsEdges) and write its PTL/ATL."""
+    if matcher is not None:
+        edges = remap_prefixes(dns_index_edges(edges) if isinstance(edges, DnsIndex) else edges, matcher)
+    df = load_matched_weights(weight_csv_path, edges, registry, is_frequency=is_frequency)
 
+    result = propagate_weights(df[["domain_id", "weight"]], edges)
+    domain_weights = df.groupby("domain_id")["weight"].sum()
+    save_propagation(result, registry, output_pfx_path, output_as_path, rollup=rollup,
+                     output_format=output_format, top_n=top_n, domain_weights=domain_weights)
+
+def save_propagation(result, registry, output_pfx_path, output_as_path, rollup=False, output_format="csv", top_n=None, domain_weights=None):
+    """Write a Propagation as joined-string CSVs or ("parquet") weight tables plus long membership tables."""
+    if output_format == "parquet":
+        save_long_top_lists(result, registry, output_pfx_path, output_as_path, rollup=rollup, top_n=top_n, domain_weights=domain_weights)
+        return
+    if top_n is not None:
+        result = truncate_members(result, top_n, domain_weights)
+    df_pfx, df_as = format_top_lists(result, registry)
+    save_top_lists(df_pfx, df_as, output_pfx_path, output_as_path, rollup=rollup)
+
+def save_top_lists(df_pfx, df_as, output_pfx_path, output_as_path, rollup=False):
     df_pfx.to_csv(output_pfx_path, index=False)
     print(f"✅ Saved Prefix Top List: {output_pfx_path}")
     pprint(df_pfx.head(5))
-
-    # Aggregate to AS-level
-    as_weights, as_prefixes, as_domains, as_ips = {}, {}, {}, {}
-    for pfx, weight in pfx_weights.items():
-        for asn in pfx2as.get(pfx, []):
-            as_weights[asn] = as_weights.get(asn, 0) + weight
-            as_prefixes.setdefault(asn, set()).add(pfx)
-            as_domains.setdefault(asn, set()).update(pfx_domains[pfx])
-            as_ips.setdefault(asn, set()).update(pfx_ips.get(pfx, set()))
-
-    df_as = pd.DataFrame([
-        {
-            "asn": asn,
-            "weight": as_weights[asn],
-            "prefixes": ", ".join(sorted(as_prefixes[asn])),
-            "domains": ", ".join(sorted(as_domains[asn])),
-            "ips": ", ".join(sorted(as_ips[asn]))
-        }
-        for asn in as_weights
-    ]).sort_values(by="weight", ascending=False)
+    if rollup:
+        save_prefix_rollup(df_pfx, output_pfx_path)
 
     df_as.to_csv(output_as_path, index=False)
     print(f"✅ Saved AS Top List: {output_as_path}")
@@ -169,12 +370,801 @@ def distribute_weights(domain2pfx, ip2pfx, pfx2as, weight_csv_path, output_pfx_p
 
     print(f"🎯 Total weight sum: {df_pfx['weight'].sum():.6f} (should be 1.0)")
 
+# ---------- Columnar Propagation Engine ----------
+# Edge tables of the DNS mapping: domain_ip (domain_id, ip), ip_pfx (ip, prefix), pfx_as (prefix, asn),
+# plus the ids of all domains that have DNS data. Edge order mirrors the list/set order of the dicts.
+DnsEdges = namedtuple("DnsEdges", ["domain_ip", "ip_pfx", "pfx_as", "domain_ids"])
+
+# Result of one propagation: weight tables in first-seen order and (group, member) membership tables
+Propagation = namedtuple("Propagation", ["pfx", "asn", "pfx_domains", "pfx_ips", "pfx_ases",
+                                         "as_prefixes", "as_domains", "as_ips"])
+
+def _csr_gather(keys, indptr):
+    """
+    For each key (in order) the positions of its CSR entries (in stored order).
+    Returns (key row of every gathered entry, entry position); keys without entries yield nothing.
+    """
+    starts = indptr[keys]
+    degree = indptr[keys + 1] - starts
+    rows = np.repeat(np.arange(len(keys)), degree)
+    offsets = np.arange(len(rows)) - np.repeat(np.cumsum(degree) - degree, degree)
+    return rows, np.repeat(starts, degree) + offsets
+
+def propagate_weights(weights, edges):
+    """
+    Propagate (domain_id, weight) rows down domain → IP → prefix → AS with grouped reductions.
+
+    Each row's weight is split equally over the domain's IPs; IP weights are summed and handed in
+    full to each of the IP's prefixes, prefix weights in full to each origin AS. Sums run with
+    bincount in the same order as the former dict loops, so weights are bit-for-bit identical.
+    edges is a DnsIndex (walked in place, e.g. memory-mapped) or DnsEdges (indexed first).
+    """
+    row_domains = weights["domain_id"].to_numpy()
+    if isinstance(edges, DnsEdges):
+        edge_domains = edges.domain_ip["domain_id"].to_numpy()
+        edges = edges_to_index(edges, int(max(edge_domains.max(initial=-1), row_domains.max(initial=-1))) + 1)
+    (domain_ip_ptr, domain_ip_ip), (ip_pfx_ptr, ip_pfx_pfx), (pfx_as_ptr, pfx_as_asn) = edges.domain_ip, edges.ip_pfx, edges.pfx_as
+
+    # Domain → IP: equal split per weight-file row
+    rows, positions = _csr_gather(row_domains, domain_ip_ptr)
+    degree = np.bincount(rows, minlength=len(row_domains))
+    split_weight = weights["weight"].to_numpy() / np.maximum(degree, 1)
+    row_ips = domain_ip_ip[positions]
+    ip_local, weighted_ips = pd.factorize(row_ips)
+    ip_weight = np.bincount(ip_local, weights=split_weight[rows], minlength=len(weighted_ips))
+    ip_domains = pd.DataFrame({"ip": row_ips, "domain_id": row_domains[rows]}).drop_duplicates()
+
+    # IP → prefix: every prefix of a weighted IP receives the full IP weight
+    rows, positions = _csr_gather(weighted_ips, ip_pfx_ptr)
+    pfx_local, weighted_pfxs = pd.factorize(ip_pfx_pfx[positions])
+    pfx_weight = np.bincount(pfx_local, weights=ip_weight[rows], minlength=len(weighted_pfxs))
+    pfx_domains = (pd.DataFrame({"group": pfx_local, "ip": weighted_ips[rows]})
+                   .merge(ip_domains, on="ip")[["group", "domain_id"]].drop_duplicates())
+    pfx_group = np.full(len(pfx_as_ptr) - 1, -1)
+    pfx_group[weighted_pfxs] = np.arange(len(weighted_pfxs))
+    groups = pfx_group[ip_pfx_pfx]
+    positions = np.flatnonzero(groups >= 0)
+    pfx_ips = pd.DataFrame({"group": groups[positions], "ip": np.searchsorted(ip_pfx_ptr, positions, side="right") - 1}).drop_duplicates()
+
+    # Prefix → AS: every origin AS of a weighted prefix receives the full prefix weight
+    rows, positions = _csr_gather(weighted_pfxs, pfx_as_ptr)
+    asn_codes = pfx_as_asn[positions]
+    as_local, weighted_asns = pd.factorize(asn_codes)
+    as_weight = np.bincount(as_local, weights=pfx_weight[rows], minlength=len(weighted_asns))
+    pfx_ases = pd.DataFrame({"group": rows, "asn": _labels(edges.asns, asn_codes)})
+    as_prefixes = pd.DataFrame({"group": as_local, "pfx": rows})
+    as_domains = (as_prefixes.merge(pfx_domains.rename(columns={"group": "pfx"}), on="pfx")
+                  [["group", "domain_id"]].drop_duplicates())
+    as_ips = (as_prefixes.merge(pfx_ips.rename(columns={"group": "pfx"}), on="pfx")
+              [["group", "ip"]].drop_duplicates())
+
+    # Decode codes to strings only for the values in the result
+    return Propagation(
+        pfx=pd.DataFrame({"prefix": _labels(edges.prefixes, weighted_pfxs), "weight": pfx_weight}),
+        asn=pd.DataFrame({"asn": _labels(edges.asns, weighted_asns), "weight": as_weight}),
+        pfx_domains=pfx_domains,
+        pfx_ips=pfx_ips.assign(ip=_labels(edges.ips, pfx_ips["ip"])),
+        pfx_ases=pfx_ases,
+        as_prefixes=as_prefixes.assign(pfx=_labels(edges.prefixes, weighted_pfxs[as_prefixes["pfx"].to_numpy()])),
+        as_domains=as_domains,
+        as_ips=as_ips.assign(ip=_labels(edges.ips, as_ips["ip"])),
+    )
+
+def _join_members(members, column, num_groups):
+    """", ".join(sorted(set(...))) of one membership table, aligned to group codes 0..num_groups-1."""
+    joined = np.full(num_groups, "", dtype=object)
+    if len(members):
+        pairs = members[["group", column]].drop_duplicates().sort_values(["group", column])
+        groups, values = pairs["group"].to_numpy(), pairs[column].to_numpy(dtype=object)
+        starts = np.flatnonzero(np.diff(groups, prepend=-1))
+        ends = np.append(starts[1:], len(groups))
+        joined[groups[starts]] = [", ".join(values[a:b].tolist()) for a, b in zip(starts, ends)]
+    return joined
+
+def format_top_lists(result, registry):
+    """Build the PTL and ATL frames with joined member columns from a Propagation."""
+    decode = lambda members: members.assign(domain=registry.decode(members["domain_id"]))
+    df_pfx = result.pfx.assign(
+        domains=_join_members(decode(result.pfx_domains), "domain", len(result.pfx)),
+        ips=_join_members(result.pfx_ips, "ip", len(result.pfx)),
+        ases=_join_members(result.pfx_ases, "asn", len(result.pfx)),
+    ).sort_values(by="weight", ascending=False)
+    df_as = result.asn.assign(
+        prefixes=_join_members(result.as_prefixes, "pfx", len(result.asn)),
+        domains=_join_members(decode(result.as_domains), "domain", len(result.asn)),
+        ips=_join_members(result.as_ips, "ip", len(result.asn)),
+    ).sort_values(by="weight", ascending=False)
+    return df_pfx, df_as
+
+# ---------- Long-Format Output ----------
+# Membership tables of a Propagation: output name -> (field, member column, output column)
+PTL_MEMBERS = {"domains": ("pfx_domains", "domain_id", "domain"), "ips": ("pfx_ips", "ip", "ip"), "ases": ("pfx_ases", "asn", "asn")}
+ATL_MEMBERS = {"prefixes": ("as_prefixes", "pfx", "prefix"), "domains": ("as_domains", "domain_id", "domain"), "ips": ("as_ips", "ip", "ip")}
+
+def _top_members(members, column, top_n, member_weight=None):
+    """Keep the top_n members per group: heaviest first when member weights are known, else in sorted order."""
+    members = members[["group", column]].drop_duplicates()
+    weight = member_weight(members[column]) if member_weight is not None else np.zeros(len(members))
+    members = members.assign(_weight=np.asarray(weight, dtype=float)).sort_values(["group", "_weight", column], ascending=[True, False, True])
+    return members[members.groupby("group").cumcount() < top_n].drop(columns="_weight")
+
+def truncate_members(result, top_n, domain_weights=None):
+    """
+    Limit every membership table of a Propagation to top_n members per prefix/AS. Domains are ranked by
+    their DTL weight (domain_weights: Series by domain_id) and an AS's prefixes by prefix weight.
+    """
+    domain_weight = None if domain_weights is None else (lambda ids: domain_weights.reindex(ids.to_numpy()).fillna(0.0).to_numpy())
+    pfx_weights = result.pfx.set_index("prefix")["weight"]
+    member_weights = {"domain_id": domain_weight, "pfx": lambda prefixes: pfx_weights.reindex(prefixes.to_numpy()).to_numpy()}
+    return result._replace(**{field: _top_members(getattr(result, field), column, top_n, member_weights.get(column))
+                              for field, column, _ in chain(PTL_MEMBERS.values(), ATL_MEMBERS.values())})
+
+def _save_long_table(result, members, weights, key, spec, registry, path):
+    """
+    Weight table (with complete member counts from result) at <stem>.parquet and one (key, member)
+    table per membership of members (possibly truncated), rows in weight order.
+    """
+    stem = os.path.splitext(path)[0]
+    order = np.argsort(-weights["weight"].to_numpy(), kind="stable")
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+    df = weights.assign(**{f"num_{name}": np.bincount(getattr(result, field)[["group", column]].drop_duplicates()["group"].to_numpy(),
+                                                        minlength=len(weights))
+                           for name, (field, column, _) in spec.items()}).iloc[order]
+    pq.write_table(pa.Table.from_pandas(df, preserve_index=False), f"{stem}.parquet", compression="zstd")
+    keys = weights[key].to_numpy(dtype=object)
+    for name, (field, column, output_column) in spec.items():
+        table = getattr(members, field)[["group", column]].drop_duplicates()
+        groups, values = table["group"].to_numpy(), table[column].to_numpy()
+        values = registry.decode(values) if column == "domain_id" else values.astype(object)
+        long = pd.DataFrame({"_rank": rank[groups], key: keys[groups], output_column: values})
+        long = long.sort_values(["_rank", output_column]).drop(columns="_rank")
+        pq.write_table(pa.Table.from_pandas(long, preserve_index=False), f"{stem}_{name}.parquet", compression="zstd")
+    return df
+
+def save_long_top_lists(result, registry, output_pfx_path, output_as_path, rollup=False, top_n=None, domain_weights=None):
+    """
+    Long-format PTL/ATL: <stem>.parquet weight tables (prefix/asn, weight, num_* member counts) and
+    <stem>_domains/_ips/_ases (PTL) and <stem>_prefixes/_domains/_ips (ATL) membership tables instead
+    of joined strings. top_n limits the members written per prefix/AS; counts stay complete.
+    """
+    members = result if top_n is None else truncate_members(result, top_n, domain_weights)
+    df_pfx = _save_long_table(result, members, result.pfx, "prefix", PTL_MEMBERS, registry, output_pfx_path)
+    df_as = _save_long_table(result, members, result.asn, "asn", ATL_MEMBERS, registry, output_as_path)
+    print(f"✅ Saved Prefix Top List (long format): {os.path.splitext(output_pfx_path)[0]}.parquet")
+    pprint(df_pfx.head(5))
+    print(f"✅ Saved AS Top List (long format): {os.path.splitext(output_as_path)[0]}.parquet")
+    pprint(df_as.head(5))
+    if rollup:
+        save_prefix_rollup(df_pfx, output_pfx_path)
+    print(f"🎯 Total weight sum: {df_pfx['weight'].sum():.6f} (should be 1.0)")
+
+# ---------- Sparse Multi-Vector Propagation ----------
+# domain_ip carries the equal split (1/#IPs of the domain), ip_pfx and pfx_as are 0/1 incidence;
+# domain_pfx = domain_ip @ ip_pfx and domain_as = domain_pfx @ pfx_as map domain weights in one product.
+Incidence = namedtuple("Incidence", ["domain_ip", "ip_pfx", "pfx_as", "domain_pfx", "domain_as", "ips", "prefixes", "asns"])
+
+def _incidence_matrix(rows, cols, shape, values=None):
+    matrix = sparse.csr_matrix((np.ones(len(rows)) if values is None else values, (rows, cols)), shape=shape)
+    matrix.sum_duplicates()
+    if values is None:
+        matrix.data[:] = 1.0
+    return matrix
+
+def _csr_incidence(csr, shape, values=None):
+    """Sparse matrix over the (deduplicated) CSR arrays of a DnsIndex, without copying them."""
+    indptr, indices = csr
+    return sparse.csr_matrix((np.ones(len(indices)) if values is None else values, indices, indptr), shape=shape)
+
+def build_incidence(edges, num_domains):
+    """
+    Sparse incidence matrices of DnsEdges (domains are registry ids, so num_domains >= len(registry)),
+    or of a DnsIndex, whose CSR arrays are used as they are (its domain rows end at the indexed domains).
+    """
+    if isinstance(edges, DnsIndex):
+        shapes = [len(csr[0]) - 1 for csr in (edges.domain_ip, edges.ip_pfx, edges.pfx_as)] + [len(edges.asns)]
+        degree = np.diff(edges.domain_ip[0])
+        A = _csr_incidence(edges.domain_ip, shapes[0:2], values=np.repeat(1.0 / np.maximum(degree, 1), degree))
+        B = _csr_incidence(edges.ip_pfx, shapes[1:3])
+        C = _csr_incidence(edges.pfx_as, shapes[2:4])
+        domain_pfx = (A @ B).tocsr()
+        return Incidence(A, B, C, domain_pfx, (domain_pfx @ C).tocsr(), edges.ips, edges.prefixes, edges.asns)
+    domain_ip, ip_pfx, pfx_as = edges.domain_ip.drop_duplicates(), edges.ip_pfx, edges.pfx_as
+    ip_codes, ips = pd.factorize(pd.concat([domain_ip["ip"], ip_pfx["ip"]], ignore_index=True))
+    pfx_codes, prefixes = pd.factorize(pd.concat([ip_pfx["prefix"], pfx_as["prefix"]], ignore_index=True))
+    as_codes, asns = pd.factorize(pfx_as["asn"])
+    domains = domain_ip["domain_id"].to_numpy()
+    split = 1.0 / np.bincount(domains, minlength=num_domains)[domains]
+    A = _incidence_matrix(domains, ip_codes[:len(domain_ip)], (num_domains, len(ips)), values=split)
+    B = _incidence_matrix(ip_codes[len(domain_ip):], pfx_codes[:len(ip_pfx)], (len(ips), len(prefixes)))
+    C = _incidence_matrix(pfx_codes[len(ip_pfx):], as_codes, (len(prefixes), len(asns)))
+    domain_pfx = (A @ B).tocsr()
+    return Incidence(A, B, C, domain_pfx, (domain_pfx @ C).tocsr(),
+                     np.asarray(ips, dtype=object), np.asarray(prefixes, dtype=object), np.asarray(asns, dtype=object))
+
+def propagate_weight_matrix(weights, incidence):
+    """
+    Propagate every weight column of a (domain_id, column...) frame at once: one sparse product
+    each for prefixes and ASes. Missing (NaN) weights count as zero. Returns dense
+    (#prefixes x #columns, #ASes x #columns) arrays.
+    """
+    columns = [c for c in weights.columns if c != "domain_id"]
+    values = weights[columns].fillna(0.0).to_numpy(dtype=float)
+    rows = np.repeat(weights["domain_id"].to_numpy(), len(columns))
+    cols = np.tile(np.arange(len(columns)), len(weights))
+    W = sparse.csr_matrix((values.ravel(), (rows, cols)), shape=(incidence.domain_pfx.shape[0], len(columns)))
+    return (incidence.domain_pfx.T @ W).toarray(), (incidence.domain_as.T @ W).toarray()
+
+def _pairs(matrix):
+    coo = matrix.tocoo()
+    return coo.row, coo.col
+
+def sparse_propagation(incidence, active_domains, pfx_weight, as_weight):
+    """Propagation (as from propagate_weights) of one weight vector, membership read off the matrix structure."""
+    active_domains = pd.unique(np.asarray(active_domains, dtype=np.int64))
+    domain_rows, pfx_cols = _pairs(incidence.domain_pfx[active_domains])
+    weighted_pfxs = np.unique(pfx_cols)
+    pfx_group = np.full(len(incidence.prefixes), -1)
+    pfx_group[weighted_pfxs] = np.arange(len(weighted_pfxs))
+    as_rows, as_cols = _pairs(incidence.pfx_as[weighted_pfxs])
+    weighted_asns = np.unique(as_cols)
+    as_group = np.full(len(incidence.asns), -1)
+    as_group[weighted_asns] = np.arange(len(weighted_asns))
+    pfx_ip_rows, pfx_ip_cols = _pairs(incidence.ip_pfx.T.tocsr()[weighted_pfxs])
+    as_domain_rows, as_domain_cols = _pairs(incidence.domain_as[active_domains])
+    as_ip = (incidence.pfx_as[weighted_pfxs].T @ incidence.ip_pfx.T.tocsr()[weighted_pfxs]).tocsr()[weighted_asns]
+    as_ip_rows, as_ip_cols = _pairs(as_ip)
+    return Propagation(
+        pfx=pd.DataFrame({"prefix": _labels(incidence.prefixes, weighted_pfxs), "weight": pfx_weight[weighted_pfxs]}),
+        asn=pd.DataFrame({"asn": _labels(incidence.asns, weighted_asns), "weight": as_weight[weighted_asns]}),
+        pfx_domains=pd.DataFrame({"group": pfx_group[pfx_cols], "domain_id": active_domains[domain_rows]}),
+        pfx_ips=pd.DataFrame({"group": pfx_ip_rows, "ip": _labels(incidence.ips, pfx_ip_cols)}),
+        pfx_ases=pd.DataFrame({"group": as_rows, "asn": _labels(incidence.asns, as_cols)}),
+        as_prefixes=pd.DataFrame({"group": as_group[as_cols], "pfx": _labels(incidence.prefixes, weighted_pfxs[as_rows])}),
+        as_domains=pd.DataFrame({"group": as_group[as_domain_cols], "domain_id": active_domains[as_domain_rows]}),
+        as_ips=pd.DataFrame({"group": as_ip_rows, "ip": _labels(incidence.ips, as_ip_cols)}),
+    )
+
+def distribute_weight_vectors(variants, edges, registry, rollup=False, output_format="csv", top_n=None):
+    """
+    Build several PTL/ATL pairs in one pass. variants: list of dicts with weight_file, pfx_out, as_out
+    and optionally is_frequency; each weight file becomes one column of a sparse weight matrix.
+    """
+    weights = None
+    for j, variant in enumerate(variants):
+        df = load_matched_weights(variant["weight_file"], edges, registry, is_frequency=variant.get("is_frequency", False))
+        column = df.groupby("domain_id")["weight"].sum().rename(j)
+        weights = column.to_frame() if weights is None else weights.join(column, how="outer")
+    weights = weights.rename_axis("domain_id").reset_index()
+    incidence = build_incidence(edges, len(registry))
+    print(f"\n🧮 Propagating {len(variants)} weight vectors through {incidence.domain_pfx.nnz} domain-prefix links...")
+    pfx_weights, as_weights = propagate_weight_matrix(weights, incidence)
+    for j, variant in enumerate(variants):
+        active = weights.loc[weights[j].notna(), "domain_id"].to_numpy()
+        result = sparse_propagation(incidence, active, pfx_weights[:, j], as_weights[:, j])
+        save_propagation(result, registry, variant["pfx_out"], variant["as_out"], rollup=rollup,
+                         output_format=output_format, top_n=top_n, domain_weights=weights.set_index("domain_id")[j].dropna())
+
+# ---------- Longest-Prefix Match ----------
+ADDRESS_FAMILIES = {4: (socket.AF_INET, 32), 6: (socket.AF_INET6, 128)}
+
+def pack_addresses(addresses, version):
+    """
+    Pack address strings into sortable big-endian keys (uint32 for IPv4, 16-byte strings for IPv6)
+    with inet_pton. Returns (keys, valid mask); addresses of the other family are marked invalid.
+    """
+    family, bits = ADDRESS_FAMILIES[version]
+    dtype = ">u4" if version == 4 else "S16"
+    addresses = list(addresses)
+    try:
+        packed = [socket.inet_pton(family, a) for a in addresses]
+        valid = np.ones(len(addresses), dtype=bool)
+    except (OSError, TypeError):
+        zero = bytes(bits // 8)
+        packed, valid = [], np.zeros(len(addresses), dtype=bool)
+        for i, a in enumerate(addresses):
+            try:
+                packed.append(socket.inet_pton(family, a))
+                valid[i] = True
+            except (OSError, TypeError):
+                packed.append(zero)
+    keys = np.frombuffer(b"".join(packed), dtype=dtype)
+    return (keys.astype(np.uint64) if version == 4 else keys), valid
+
+class PrefixMatcher:
+    """
+    Longest-prefix match for IPv4 and IPv6, built once from a prefix→origin-AS table.
+
+    Nested prefixes are flattened into disjoint address intervals, each labelled with its most
+    specific covering prefix, so a batch of lookups is one searchsorted per address family.
+    """
+    def __init__(self, pfx_as):
+        pfx_as = pfx_as[["prefix", "asn"]].astype(str)
+        networks = {}
+        for prefix in pd.unique(pfx_as["prefix"]):
+            try:
+                networks[prefix] = ipaddress.ip_network(prefix.strip(), strict=False)
+            except ValueError:
+                continue
+        pfx_as = pfx_as[pfx_as["prefix"].isin(networks.keys())]
+        pfx_as = pfx_as.assign(prefix=[str(networks[p]) for p in pfx_as["prefix"]]).drop_duplicates()
+        self.origins = pfx_as.reset_index(drop=True)
+        self.prefixes = np.array(pd.unique(self.origins["prefix"]), dtype=object)
+        by_version = {4: [], 6: []}
+        for i, prefix in enumerate(self.prefixes):
+            net = ipaddress.ip_network(prefix)
+            by_version[net.version].append((int(net.network_address), net.prefixlen, int(net.broadcast_address), i))
+        self._intervals = {version: self._flatten(sorted(nets), version) for version, nets in by_version.items()}
+
+    @staticmethod
+    def _flatten(networks, version):
+        """Sweep (start, length, end, index) sorted networks with a stack of open enclosing prefixes."""
+        limit = (1 << ADDRESS_FAMILIES[version][1]) - 1
+        starts, owners, stack = [], [], []
+        def emit(start, owner):
+            if start > limit:
+                return
+            if starts and starts[-1] == start:
+                owners[-1] = owner
+            else:
+                starts.append(start)
+                owners.append(owner)
+        for start, _, end, index in networks:
+            while stack and stack[-1][0] < start:
+                emit(stack.pop()[0] + 1, stack[-1][1] if stack else -1)
+            emit(start, index)
+            stack.append((end, index))
+        while stack:
+            emit(stack.pop()[0] + 1, stack[-1][1] if stack else -1)
+        if version == 4:
+            keys = np.array(starts, dtype=np.uint64)
+        else:
+            keys = np.array([start.to_bytes(16, "big") for start in starts], dtype="S16")
+        return keys, np.array(owners, dtype=np.int64)
+
+    @classmethod
+    def from_file(cls, path):
+        """
+        Load a CAIDA RouteViews pfx2as file (address<TAB>length<TAB>asn, optionally .gz) or a CSV with
+        prefix,asn columns. MOAS ("_") and AS-set (",") origins become one row per AS.
+        """
+        print(f"\n🗺️ Loading prefix-to-AS table: {path}")
+        if path.endswith(".csv"):
+            df = pd.read_csv(path, dtype=str, keep_default_na=False)
+            df = df.rename(columns={"ip_prefix": "prefix", "as": "asn"})[["prefix", "asn"]]
+        else:
+            df = pd.read_csv(path, sep="\t", header=None, names=["address", "length", "asn"], dtype=str, keep_default_na=False)
+            df = pd.DataFrame({"prefix": df["address"] + "/" + df["length"], "asn": df["asn"]})
+        df = df.assign(asn=df["asn"].str.split(r"[_,]")).explode("asn")
+        matcher = cls(df[df["asn"] != ""])
+        print(f"✅ {len(matcher.prefixes)} prefixes, {len(matcher.origins)} prefix-origin pairs")
+        return matcher
+
+    def lookup(self, addresses):
+        """Index into self.prefixes of the longest matching prefix of each address, -1 if none."""
+        addresses = np.asarray(addresses, dtype=object)
+        result = np.full(len(addresses), -1, dtype=np.int64)
+        is_v6 = np.array([":" in a if isinstance(a, str) else False for a in addresses], dtype=bool)
+        for version, mask in ((4, ~is_v6), (6, is_v6)):
+            starts, owners = self._intervals[version]
+            positions = np.flatnonzero(mask)
+            if not len(positions) or not len(starts):
+                continue
+            keys, valid = pack_addresses(addresses[positions], version)
+            slot = np.searchsorted(starts, keys, side="right") - 1
+            found = valid & (slot >= 0)
+            result[positions[found]] = owners[slot[found]]
+        return result
+
+    def lookup_prefixes(self, addresses):
+        """Longest matching prefix string of each address (None if unrouted)."""
+        index = self.lookup(addresses)
+        return np.where(index >= 0, self.prefixes[index], None)
+
+def remap_prefixes(edges, matcher):
+    """
+    Replace the ip_pfx/pfx_as edges (the CSV prefix and AS columns) with longest-prefix matches of
+    the mapped IPs against a routing table and that table's origin ASes.
+    """
+    ip_pfx, pfx_as = routed_prefix_edges(pd.unique(edges.domain_ip["ip"]), matcher)
+    return edges._replace(ip_pfx=ip_pfx, pfx_as=pfx_as)
+
+def routed_prefix_edges(ips, matcher):
+    """(ip_pfx, pfx_as) edges of distinct IPs from their longest-prefix matches and the matched prefixes' origin ASes."""
+    ips = np.asarray(ips, dtype=object)
+    index = matcher.lookup(ips)
+    routed = index >= 0
+    ip_pfx = pd.DataFrame({"ip": ips[routed], "prefix": matcher.prefixes[index[routed]]})
+    pfx_as = matcher.origins[matcher.origins["prefix"].isin(ip_pfx["prefix"])].reset_index(drop=True)
+    print(f"🗺️ Longest-prefix match: {routed.sum()} of {len(ips)} IPs routed to {ip_pfx['prefix'].nunique()} prefixes")
+    return ip_pfx, pfx_as
+
+# ---------- Prefix Hierarchy Roll-up ----------
+ROLLUP_LENGTHS = {4: (8, 16), 6: (32,)}
+
+def parse_prefix(prefix):
+    """(version, first address, length) of a prefix string as integers, host bits cleared; None if invalid."""
+    try:
+        address, length = prefix.strip().split("/")
+        version = 6 if ":" in address else 4
+        family, bits = ADDRESS_FAMILIES[version]
+        length = int(length)
+        if not 0 <= length <= bits:
+            return None
+        host_bits = bits - length
+        return version, int.from_bytes(socket.inet_pton(family, address), "big") >> host_bits << host_bits, length
+    except (AttributeError, ValueError, OSError):
+        return None
+
+def format_prefix(version, start, length):
+    family, bits = ADDRESS_FAMILIES[version]
+    return f"{socket.inet_ntop(family, start.to_bytes(bits // 8, 'big'))}/{length}"
+
+def prefix_tree(prefixes):
+    """
+    Containment tree of prefix strings from one stack sweep over (family, start, length) order.
+    Returns (parsed prefixes, parent index of the nearest covering prefix or -1, depth).
+    """
+    parsed = [parse_prefix(prefix) if isinstance(prefix, str) else None for prefix in prefixes]
+    order = sorted((i for i, net in enumerate(parsed) if net is not None), key=parsed.__getitem__)
+    parent = np.full(len(parsed), -1, dtype=np.int64)
+    depth = np.zeros(len(parsed), dtype=np.int64)
+    stack = []  # (version, last address, index) of the open enclosing prefixes
+    for i in order:
+        version, start, length = parsed[i]
+        while stack and (stack[-1][0] != version or stack[-1][1] < start):
+            stack.pop()
+        if stack:
+            parent[i] = stack[-1][2]
+            depth[i] = depth[parent[i]] + 1
+        stack.append((version, start | ((1 << (ADDRESS_FAMILIES[version][1] - length)) - 1), i))
+    return parsed, parent, depth
+
+def rollup_prefix_top_list(df_pfx, lengths=ROLLUP_LENGTHS):
+    """
+    Roll PTL weights up the prefix hierarchy in one bottom-up pass (deepest level first).
+
+    Returns the tree view (direct weight as listed in the PTL, cumulative weight of the prefix and
+    all its more-specifics, number of more-specifics, covering prefix) and one aggregated view per
+    fixed length, e.g. {"ipv4_8": ..., "ipv4_16": ..., "ipv6_32": ...}, summing direct weights of
+    the prefixes inside each /length block.
+    """
+    prefixes = df_pfx["prefix"].to_numpy(dtype=object)
+    direct = df_pfx["weight"].to_numpy(dtype=float)
+    parsed, parent, depth = prefix_tree(prefixes)
+
+    cumulative = direct.copy()
+    more_specifics = np.zeros(len(prefixes), dtype=np.int64)
+    by_depth = np.argsort(depth, kind="stable")
+    level_starts = np.searchsorted(depth[by_depth], np.arange(depth.max(initial=0) + 2))
+    for d in range(depth.max(initial=0), 0, -1):
+        level = by_depth[level_starts[d]:level_starts[d + 1]]
+        np.add.at(cumulative, parent[level], cumulative[level])
+        np.add.at(more_specifics, parent[level], more_specifics[level] + 1)
+
+    df_tree = pd.DataFrame({
+        "prefix": prefixes,
+        "cumulative_weight": cumulative,
+        "direct_weight": direct,
+        "more_specifics": more_specifics,
+        "covering_prefix": np.where(parent >= 0, prefixes[parent], ""),
+        "depth": depth,
+    }).sort_values(by="cumulative_weight", ascending=False)
+
+    views = {}
+    for version, view_lengths in lengths.items():
+        bits = ADDRESS_FAMILIES[version][1]
+        for length in view_lengths:
+            inside = [i for i, net in enumerate(parsed) if net is not None and net[0] == version and net[2] >= length]
+            blocks = pd.Series([parsed[i][1] >> (bits - length) for i in inside], dtype=object)
+            df_view = (pd.DataFrame({"block": blocks, "weight": direct[inside]})
+                       .groupby("block", sort=False)["weight"].agg(weight="sum", prefixes="size").reset_index())
+            df_view.insert(0, "prefix", [format_prefix(version, block << (bits - length), length) for block in df_view.pop("block")])
+            views[f"ipv{version}_{length}"] = df_view.sort_values(by="weight", ascending=False)
+    return df_tree, views
+
+def save_prefix_rollup(df_pfx, output_pfx_path):
+    """Write the roll-up views next to the PTL: <stem>_rollup.csv and <stem>_agg_ipv4_8.csv etc."""
+    stem = os.path.splitext(output_pfx_path)[0]
+    df_tree, views = rollup_prefix_top_list(df_pfx)
+    df_tree.to_csv(f"{stem}_rollup.csv", index=False)
+    print(f"✅ Saved Prefix Roll-up: {stem}_rollup.csv")
+    pprint(df_tree.head(5))
+    for name, df_view in views.items():
+        df_view.to_csv(f"{stem}_agg_{name}.csv", index=False)
+        print(f"✅ Saved /{name.split('_')[1]} aggregate ({name.split('_')[0]}): {stem}_agg_{name}.csv")
+
+# ---------- Out-of-Core Builder ----------
+# Two hash-partitioned stages keep the working set at one partition: DNS tuples and weights are
+# spilled by domain, each domain partition yields per-IP partial weights (spilled by IP), and each IP
+# partition yields per-prefix partial sums; only those and the prefix→AS pairs are merged in memory.
+SPILL_BYTES_PER_INPUT_BYTE = {".gz": 12, ".parquet": 12, "": 3}
+
+def spill_partitions(dns_filepaths, memory_budget):
+    """Number of partitions so that one partition's frames stay within memory_budget bytes."""
+    expanded = 0
+    for path in dns_filepaths:
+        size = sum(os.path.getsize(f) for f in glob.glob(os.path.join(path, "**", "*"), recursive=True) if os.path.isfile(f)) if os.path.isdir(path) else os.path.getsize(path)
+        expanded += size * SPILL_BYTES_PER_INPUT_BYTE.get(".parquet" if is_parquet_source(path) else os.path.splitext(path)[1], SPILL_BYTES_PER_INPUT_BYTE[""])
+    return max(1, math.ceil(expanded / memory_budget))
+
+def partition_of(values, partitions):
+    """Stable (process-independent) hash partition of string values."""
+    return (pd.util.hash_array(np.asarray(values, dtype=object)) % np.uint64(partitions)).astype(np.int64)
+
+class SpillWriter:
+    """Append tables to one Arrow IPC stream per partition: <dir>/<name>-<tag>-<partition>.arrow."""
+
+    def __init__(self, directory, name, partitions, tag=0):
+        self.directory, self.name, self.partitions, self.tag = directory, name, partitions, tag
+        self.writers = {}
+
+    def write(self, table, key):
+        if isinstance(table, pd.DataFrame):
+            table = pa.Table.from_pandas(table, preserve_index=False)
+        if not table.num_rows:
+            return
+        parts = partition_of(table.column(key).to_numpy(zero_copy_only=False), self.partitions)
+        for partition in np.unique(parts):
+            if partition not in self.writers:
+                path = os.path.join(self.directory, f"{self.name}-{self.tag}-{partition:05d}.arrow")
+                self.writers[partition] = pa.ipc.new_stream(pa.OSFile(path, "wb"), table.schema)
+            self.writers[partition].write_table(table.filter(pa.array(parts == partition)))
+
+    def close(self):
+        for writer in self.writers.values():
+            writer.close()
+        self.writers = {}
+
+def read_spill(directory, name, partition, columns):
+    """All spilled pieces (from every tag) of one partition as a DataFrame."""
+    paths = sorted(glob.glob(os.path.join(directory, f"{name}-*-{partition:05d}.arrow")))
+    if not paths:
+        return pd.DataFrame({column: pd.Series(dtype=dtype) for column, dtype in columns.items()})
+    tables = [pa.ipc.open_stream(pa.memory_map(path, "r")).read_all() for path in paths]
+    return pa.concat_tables(tables).to_pandas()
+
+def spill_dns_file(path, spill_dir, partitions, tag):
+    """Stage 0: stream one DNS source into the domain-partitioned spill."""
+    print(f"  → Spilling: {path}")
+    writer = SpillWriter(spill_dir, "dns", partitions, tag)
+    for table in iter_dns_batches(path):
+        writer.write(table, "domain")
+    writer.close()
+
+def canonical_weights(weight_path, is_frequency=False):
+    """(domain, weight) rows of a DTL with canonical domains (rows without a domain dropped) and the file's row count."""
+    df = load_weight_table(weight_path)
+    weight_col = "final_weight" if not is_frequency else "frequency"
+    if weight_col not in df.columns:
+        raise ValueError(f"Missing expected column '{weight_col}' in {weight_path}")
+    raw_domains = df["domain"].astype("category")
+    canon_domains = np.array([canonicalize_domain(d) for d in raw_domains.cat.categories] + [None], dtype=object)
+    weights = pd.DataFrame({"domain": canon_domains[raw_domains.cat.codes.to_numpy()], "weight": df[weight_col].to_numpy(dtype=float)})
+    return weights.dropna(subset=["domain"]).reset_index(drop=True), len(df)
+
+def spill_weights(weight_path, spill_dir, partitions, is_frequency=False):
+    """Stage 0: canonicalize the DTL domains and spill (domain, weight) rows by domain."""
+    weights, rows = canonical_weights(weight_path, is_frequency)
+    writer = SpillWriter(spill_dir, "weights", partitions)
+    writer.write(weights, "domain")
+    writer.close()
+    return rows
+
+def aggregate_domain_partition(spill_dir, partition, partitions):
+    """
+    Stage 1: split each matched domain's weight equally over its IPs and spill per-IP partial sums and
+    the (ip, prefix) edges by IP. Returns (matched weight, matched rows, distinct prefix→AS pairs).
+    """
+    dns = read_spill(spill_dir, "dns", partition, {"domain": object, "ip": object, "prefix": object, "asn": object})
+    weights = read_spill(spill_dir, "weights", partition, {"domain": object, "weight": float})
+    domain_ip = dns[["domain", "ip"]].drop_duplicates()
+    matched = weights[weights["domain"].isin(domain_ip["domain"])]
+    share = matched.groupby("domain")["weight"].sum() / domain_ip["domain"].value_counts()
+    ip_weight = (domain_ip.assign(weight=domain_ip["domain"].map(share)).dropna(subset=["weight"])
+                 .groupby("ip", sort=False)["weight"].sum().reset_index())
+    for name, table in (("ipw", ip_weight), ("ippfx", dns[["ip", "prefix"]].drop_duplicates())):
+        writer = SpillWriter(spill_dir, name, partitions, tag=partition)
+        writer.write(table, "ip")
+        writer.close()
+    pfx_as = dns.loc[dns["asn"] != "", ["prefix", "asn"]].drop_duplicates()
+    return matched["weight"].sum(), len(matched), pfx_as
+
+def aggregate_ip_partition(spill_dir, partition):
+    """Stage 2: per-prefix partial weight (full IP weight to each prefix) and IP count of one IP partition."""
+    ip_weight = read_spill(spill_dir, "ipw", partition, {"ip": object, "weight": float}).groupby("ip")["weight"].sum()
+    ip_pfx = read_spill(spill_dir, "ippfx", partition, {"ip": object, "prefix": object}).drop_duplicates()
+    reached = ip_pfx[ip_pfx["ip"].isin(ip_weight.index)]
+    pfx_weight = reached["ip"].map(ip_weight).groupby(reached["prefix"].to_numpy()).sum()
+    return pfx_weight, ip_pfx.groupby("prefix").size()
+
+def reduce_partials(pfx_partials, ip_count_partials, pfx_as_partials, matched_weight, is_frequency=False):
+    """Merge the per-partition prefix sums into PTL/ATL weight tables and normalize like load_matched_weights."""
+    pfx_weight = pd.concat(pfx_partials).groupby(level=0).sum()
+    num_ips = pd.concat(ip_count_partials).groupby(level=0).sum().reindex(pfx_weight.index).fillna(0).astype(int)
+    pfx_as = pd.concat(pfx_as_partials).drop_duplicates()
+    pfx_as = pfx_as[pfx_as["prefix"].isin(pfx_weight.index)]
+    if is_frequency or abs(matched_weight - 1.0) > 0.05:
+        print("ℹ️ Normalizing weights...")
+        pfx_weight = pfx_weight / matched_weight
+    as_weight = pfx_as.assign(weight=pfx_as["prefix"].map(pfx_weight).to_numpy()).groupby("asn")
+    ases = pfx_as.sort_values("asn").groupby("prefix")["asn"].agg(", ".join)
+    df_pfx = pd.DataFrame({"prefix": pfx_weight.index, "weight": pfx_weight.to_numpy(), "num_ips": num_ips.to_numpy(),
+                           "ases": ases.reindex(pfx_weight.index).fillna("").to_numpy()})
+    df_as = as_weight["weight"].sum().rename("weight").to_frame().join(as_weight.size().rename("num_prefixes")).reset_index()
+    return df_pfx.sort_values(by="weight", ascending=False), df_as.sort_values(by="weight", ascending=False)
+
+class DoneFuture:
+    """Result holder so the sequential path reads like the process-pool path."""
+
+    def __init__(self, value):
+        self.value = value
+
+    def result(self):
+        return self.value
+
+def build_top_lists_out_of_core(dns_filepaths, weight_path, output_pfx_path, output_as_path, is_frequency=False, memory_budget=None, spill_dir=None, workers=1):
+    """
+    Partitioned PTL/ATL build writing weight tables (prefix, weight, num_ips, ases / asn, weight,
+    num_prefixes) without the per-prefix domain and IP member lists.
+
+    memory_budget bounds the size of one partition; with workers > 1 the DNS files and the domain
+    and IP shards are processed in a process pool (at least one shard per worker), each worker
+    deduplicating its own mappings, and only the per-shard partial sums are reduced here.
+    """
+    partitions = max(workers, spill_partitions(dns_filepaths, memory_budget) if memory_budget else 1)
+    work_dir = tempfile.mkdtemp(prefix="ptl_spill_", dir=spill_dir)
+    print(f"\n💽 Partitioned build: {partitions} partitions, {workers} worker(s), spilling to {work_dir}")
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    run = (lambda fn, *args: executor.submit(fn, *args)) if executor else (lambda fn, *args: DoneFuture(fn(*args)))
+    try:
+        spills = [run(spill_dns_file, path, work_dir, partitions, tag) for tag, path in enumerate(dns_filepaths)]
+        weight_rows = run(spill_weights, weight_path, work_dir, partitions, is_frequency)
+        for future in spills:
+            future.result()
+        weight_rows = weight_rows.result()
+
+        domain_shards = [run(aggregate_domain_partition, work_dir, partition, partitions) for partition in range(partitions)]
+        matched_weight, matched_rows, pfx_as_partials = 0.0, 0, []
+        for future in domain_shards:
+            weight, rows, pfx_as = future.result()
+            matched_weight, matched_rows = matched_weight + weight, matched_rows + rows
+            pfx_as_partials.append(pfx_as)
+        print(f"ℹ️ Matched {matched_rows} of {weight_rows} domains from weight file to DNS")
+
+        ip_shards = [run(aggregate_ip_partition, work_dir, partition) for partition in range(partitions)]
+        pfx_partials, ip_count_partials = zip(*(future.result() for future in ip_shards))
+        df_pfx, df_as = reduce_partials(pfx_partials, ip_count_partials, pfx_as_partials, matched_weight, is_frequency=is_frequency)
+    finally:
+        if executor:
+            executor.shutdown()
+        shutil.rmtree(work_dir, ignore_errors=True)
+    save_top_lists(df_pfx, df_as, output_pfx_path, output_as_path)
+
+# ---------- Sharded In-Memory Build ----------
+# The domain-dependent work (domain → IP edges, registry lookups, propagation) runs in one process per
+# domain-hash shard over the shared IP → prefix → AS edges; the shard Propagations are then merged.
+def domain_shards(tuples, shards):
+    """Shard of every DNS tuple by the hash of its canonical domain (the domain weight rows match on)."""
+    parts = []
+    for batch in tuples.to_batches():
+        encoded = pc.dictionary_encode(batch.column("domain"))
+        aliases = pc.replace_substring(encoded.dictionary, "www.", "", max_replacements=1)
+        parts.append(partition_of(aliases.to_numpy(zero_copy_only=False), shards)[encoded.indices.to_numpy()])
+    return np.concatenate(parts) if parts else np.zeros(0, dtype=np.int64)
+
+def propagate_shard(tuples, prefix_edges, weights):
+    """
+    One domain shard: DnsEdges of the shard's tuples over the shared (ip_pfx, pfx_as) edges and the
+    propagation of its (unnormalized) weight rows. Domain members and the matched weight per domain are
+    returned as strings, as ids are private to the shard. Returns (Propagation, domain weights).
+    """
+    registry = DomainRegistry()
+    edges = build_dns_edges(tuples, registry, prefix_edges=prefix_edges)
+    weights = weights.assign(domain_id=registry.encode(weights["domain"]))
+    weights = weights[weights["domain_id"].isin(edges.domain_ids)]
+    result = propagate_weights(weights[["domain_id", "weight"]], edges)
+    decode = lambda members: members.assign(domain_id=registry.decode(members["domain_id"]))
+    return (result._replace(pfx_domains=decode(result.pfx_domains), as_domains=decode(result.as_domains)),
+            weights.groupby("domain")["weight"].sum())
+
+def reduce_propagations(parts, registry, scale=1.0):
+    """Merge shard Propagations (domain members as strings) into one over registry ids, dividing weights by scale."""
+    totals, members = {}, {}
+    for name, key, spec in (("pfx", "prefix", PTL_MEMBERS), ("asn", "asn", ATL_MEMBERS)):
+        totals[name] = pd.concat([getattr(part, name) for part in parts]).groupby(key, sort=False)["weight"].sum() / scale
+        for field, column, _ in spec.values():
+            tables = []
+            for part in parts:
+                regroup = totals[name].index.get_indexer(getattr(part, name)[key])
+                table = getattr(part, field)
+                tables.append(table.assign(group=regroup[table["group"].to_numpy()]))
+            table = pd.concat(tables, ignore_index=True)
+            if column == "domain_id":
+                table = table.assign(domain_id=registry.encode(table["domain_id"]))
+            members[field] = table.drop_duplicates().reset_index(drop=True)
+    return Propagation(pfx=totals["pfx"].reset_index(), asn=totals["asn"].reset_index(), **members)
+
+def build_top_lists_sharded(dns_filepaths, weight_path, output_pfx_path, output_as_path, is_frequency=False, matcher=None, workers=2,
+                            rollup=False, output_format="csv", top_n=None, registry=None):
+    """
+    distribute_weights with the DNS mapping built and propagated in `workers` processes, one per
+    domain-hash shard. Weights are normalized after the merge, so they agree with the single-process
+    build up to floating-point rounding; member lists are identical.
+    """
+    registry = registry if registry is not None else DomainRegistry()
+    print("\n🔍 Processing DNS resolution files...")
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        tuples = pa.concat_tables(list(executor.map(read_dns_source, dns_filepaths)))
+    prefix_edges = routed_prefix_edges(pc.unique(tuples.column("ip")).to_numpy(zero_copy_only=False), matcher) if matcher else dns_prefix_edges(tuples)
+    print(f"\n📊 Distributing weights from: {weight_path}")
+    weights, weight_rows = canonical_weights(weight_path, is_frequency)
+
+    tuple_shards = domain_shards(tuples, workers)
+    weight_shards = partition_of(weights["domain"], workers)
+    print(f"\n🧩 Sharded build: {workers} domain shards over {len(tuples)} DNS tuples")
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(propagate_shard, tuples.filter(pa.array(tuple_shards == shard)), prefix_edges, weights[weight_shards == shard])
+                   for shard in range(workers)]
+        parts, domain_weights = zip(*(future.result() for future in futures))
+
+    domain_weights = pd.concat(domain_weights)
+    matched_weight = domain_weights.sum()
+    print(f"ℹ️ Matched {weights['domain'].isin(domain_weights.index).sum()} of {weight_rows} domains from weight file to DNS")
+    scale = matched_weight if is_frequency or abs(matched_weight - 1.0) > 0.05 else 1.0
+    result = reduce_propagations(parts, registry, scale)
+    domain_weights = pd.Series(domain_weights.to_numpy() / scale, index=registry.encode(domain_weights.index)).groupby(level=0).sum()
+    save_propagation(result, registry, output_pfx_path, output_as_path, rollup=rollup,
+                     output_format=output_format, top_n=top_n, domain_weights=domain_weights)
+
 # ---------- Master Pipeline ----------
-def run_pipeline(name, dns_files, weight_file, pfx_out, as_out, is_frequency=False):
+def run_pipeline(name, dns_files, weight_file, pfx_out, as_out, is_frequency=False, pfx2as_file=None, rollup=False, index_dir=None, output_format="csv", top_n=None, memory_budget=None, workers=1):
     print(f" Running PTL/ATL Pipeline: {name}")
-    domain2ip, domain2pfx, ip2pfx, pfx2as = process_dns_files(dns_files)
-    
-    distribute_weights(domain2pfx, ip2pfx, pfx2as, weight_file, pfx_out, as_out, is_frequency=is_frequency, domain2ip=domain2ip)
+    if memory_budget:
+        # The partitioned build maps with the OpenINTEL prefix column and writes weight-only CSV tables
+        unsupported = [option for option, value in (("pfx2as_file", pfx2as_file), ("rollup", rollup), ("index_dir", index_dir),
+                                                    ("output_format", output_format != "csv"), ("top_n", top_n is not None)) if value]
+        if unsupported:
+            raise ValueError(f"The out-of-core PTL build does not support: {', '.join(unsupported)}")
+        build_top_lists_out_of_core(dns_files, weight_file, pfx_out, as_out, is_frequency=is_frequency, memory_budget=memory_budget, workers=workers)
+        return
+    if workers > 1:
+        # Shards build their own part of the mapping, so there is no single DnsEdges to index
+        if index_dir:
+            raise ValueError("The sharded PTL build (workers > 1) does not support: index_dir")
+        matcher = PrefixMatcher.from_file(pfx2as_file) if pfx2as_file else None
+        build_top_lists_sharded(dns_files, weight_file, pfx_out, as_out, is_frequency=is_frequency, matcher=matcher, workers=workers,
+                                rollup=rollup, output_format=output_format, top_n=top_n, registry=dtl_registry(weight_file))
+        return
+    edges, registry = load_pipeline_edges(dns_files, weight_file, index_dir=index_dir)
+    # Map IPs with a routing table snapshot instead of the OpenINTEL ip_prefix/as columns
+    matcher = PrefixMatcher.from_file(pfx2as_file) if pfx2as_file else None
+
+    distribute_weights(edges, registry, weight_file, pfx_out, as_out, is_frequency=is_frequency, matcher=matcher, rollup=rollup, output_format=output_format, top_n=top_n)
+
+def run_multi_pipeline(name, dns_files, variants, pfx2as_file=None, rollup=False, index_dir=None, output_format="csv", top_n=None):
+    """run_pipeline for several weight files over the same DNS mapping, propagated together (see distribute_weight_vectors)."""
+    print(f" Running PTL/ATL Pipeline: {name} ({len(variants)} variants)")
+    edges, registry = load_pipeline_edges(dns_files, variants[0]["weight_file"], index_dir=index_dir)
+    if pfx2as_file:
+        edges = remap_prefixes(dns_index_edges(edges) if isinstance(edges, DnsIndex) else edges, PrefixMatcher.from_file(pfx2as_file))
+
+    distribute_weight_vectors(variants, edges, registry, rollup=rollup, output_format=output_format, top_n=top_n)
+
+def dtl_registry(weight_file):
+    """The DTL stage's domain ids when saved next to its outputs, so both stages share one dictionary."""
+    registry_path = os.path.join(os.path.dirname(weight_file), "domain_registry.parquet")
+    return DomainRegistry.load(registry_path) if os.path.exists(registry_path) else DomainRegistry()
+
+def load_pipeline_edges(dns_files, weight_file, index_dir=None):
+    """DNS mapping and DomainRegistry for a run: the week's memory-mapped DnsIndex if it matches, else parsed DnsEdges (indexed for next time)."""
+    if index_dir and dns_index_matches(index_dir, dns_files):
+        return load_dns_index(index_dir)
+    registry = dtl_registry(weight_file)
+    edges = load_dns_edges(dns_files, registry=registry)
+    if index_dir:
+        save_dns_index(edges, index_dir, registry, dns_files)
+    return edges, registry
 
 # ---------- Main ----------
 if __name__ == "__main__":
@@ -184,9 +1174,25 @@ if __name__ == "__main__":
     # date = "20250407_to_20250413"
     date = "20250414_to_20250420"
     dns_data_dir = "../dns-resolution/openintel_data/" + date
+    dns_dataset_dir = "../dns-resolution/openintel_data/dataset"  # Hive-partitioned Parquet written by dataset_collection.py
+    dtl_ext = "csv"  # "parquet" or "arrow" if the DTL stage wrote columnar outputs (opened memory-mapped)
+    dns_ext = "dataset"  # or "csv" / "csv.gz" / "parquet" for DNS files placed in dns_data_dir
+    pfx2as_file = None  # e.g. a RouteViews routeviews-rv2-YYYYMMDD-1200.pfx2as.gz to re-map IPs against that RIB
+    rollup = False  # True to also write the prefix hierarchy roll-up and /8, /16 (IPv4) and /32 (IPv6) aggregates
+    build_index = True  # Build the week's DNS mapping index once (dns_index_<variant>/) and memory-map it on later runs
+    ptl_format = "csv"  # "parquet": weight tables + long membership tables instead of joined member strings
+    top_n = None  # e.g. 1000 to keep only the top members per prefix/AS (domains by weight)
+    memory_budget = None  # e.g. 8 << 30 to build weight-only PTL/ATLs out of core within ~8 GB (for full_sources; CSV only, no pfx2as_file/rollup/top_n)
+    workers = 1  # > 1 to shard the build over that many processes by domain hash (the partitioned one with memory_budget), e.g. os.cpu_count()
 
-    # Load all available CSVs in the data folder
-    all_dns_files = sorted(glob.glob(os.path.join(dns_data_dir, "*.csv")))
+    # Load all available DNS files in the data folder (for the dataset: the week's source=/year=/month=/day= folders)
+    if dns_ext == "dataset":
+        week_start, week_end = (pd.Timestamp(day) for day in date.split("_to_"))
+        all_dns_files = sorted(chain.from_iterable(
+            glob.glob(os.path.join(dns_dataset_dir, "source=*", f"year={day.year}", f"month={day.month:02d}", f"day={day.day:02d}"))
+            for day in pd.date_range(week_start, week_end)))
+    else:
+        all_dns_files = sorted(glob.glob(os.path.join(dns_data_dir, "*." + dns_ext)))
 
     # Use source names for curated/full separation if needed
     curated_sources = ["tranco", "umbrella", "majestic"]
@@ -198,17 +1204,55 @@ if __name__ == "__main__":
     run_pipeline(
         name="Ranked (Zipf-based)",
         dns_files=curated_dns_files,
-        weight_file="../output/domain-top-lists/" + date + "/domain_top_list_merged_ranked.csv",
+        weight_file="../output/domain-top-lists/" + date + "/domain_top_list_merged_ranked." + dtl_ext,
         pfx_out="../output/prefix-top-lists/" + date + "/prefix_top_list_ranked.csv",
         as_out="../output/as-top-lists/" + date + "/as_top_list_ranked.csv",
-        is_frequency=False
+        is_frequency=False,
+        pfx2as_file=pfx2as_file,
+        rollup=rollup,
+        index_dir=os.path.join(dns_data_dir, "dns_index_curated") if build_index and not memory_budget and workers == 1 else None,
+        output_format=ptl_format,
+        top_n=top_n,
+        memory_budget=memory_budget,
+        workers=workers
     )
 
     # run_pipeline(
     #     name="Presence-based (All Sources)",
     #     dns_files=full_dns_files,
-    #     weight_file="../output/domain-top-lists/" + date + "/domain_top_list_merged_presence.csv",
+    #     weight_file="../output/domain-top-lists/" + date + "/domain_top_list_merged_presence." + dtl_ext,
     #     pfx_out="../output/prefix-top-lists/" + date + "/prefix_top_list_presence.csv",
     #     as_out="../output/as-top-lists/" + date + "/as_top_list_presence.csv",
-    #     is_frequency=True
+    #     is_frequency=True,
+    #     pfx2as_file=pfx2as_file,
+    #     rollup=rollup,
+    #     index_dir=os.path.join(dns_data_dir, "dns_index_full") if build_index and not memory_budget and workers == 1 else None,
+    #     output_format=ptl_format,
+    #     top_n=top_n,
+    #     memory_budget=memory_budget,
+    #     workers=workers
+    # )
+
+    # Uncomment to build the per-source and merged ranked PTL/ATLs in one sparse-matrix pass
+    # (add the presence variant when running over full_dns_files)
+    # dtl_dir = "../output/domain-top-lists/" + date
+    # run_multi_pipeline(
+    #     name="Per-source + merged (one pass)",
+    #     dns_files=curated_dns_files,
+    #     variants=[
+    #         *[dict(weight_file=f"{dtl_dir}/domain_top_list_{src}.{dtl_ext}",
+    #                pfx_out=f"../output/prefix-top-lists/{date}/prefix_top_list_{src}.csv",
+    #                as_out=f"../output/as-top-lists/{date}/as_top_list_{src}.csv") for src in curated_sources],
+    #         dict(weight_file=f"{dtl_dir}/domain_top_list_merged_ranked.{dtl_ext}",
+    #              pfx_out=f"../output/prefix-top-lists/{date}/prefix_top_list_ranked.csv",
+    #              as_out=f"../output/as-top-lists/{date}/as_top_list_ranked.csv"),
+    #         # dict(weight_file=f"{dtl_dir}/domain_top_list_merged_presence.{dtl_ext}", is_frequency=True,
+    #         #      pfx_out=f"../output/prefix-top-lists/{date}/prefix_top_list_presence.csv",
+    #         #      as_out=f"../output/as-top-lists/{date}/as_top_list_presence.csv"),
+    #     ],
+    #     pfx2as_file=pfx2as_file,
+    #     rollup=rollup,
+    #     index_dir=os.path.join(dns_data_dir, "dns_index_curated") if build_index else None,
+    #     output_format=ptl_format,
+    #     top_n=top_n
     # )
@@ -0,0 +1,222 @@
+import asyncio
+import datetime
+import glob
+import io
+import json
+import os
+import sys
+import threading
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+boto3 = pytest.importorskip("boto3")
+moto = pytest.importorskip("moto")
+pytest.importorskip("psutil")
+
+DNS_RESOLUTION_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "dns-resolution")
+DATES = pd.date_range("2025-04-14", "2025-04-15").to_pydatetime()
+PARTS = 2
+
+
+@pytest.fixture(scope="module")
+def dc(tmp_path_factory):
+    """The collector, imported against moto's S3 endpoint (its data folders are relative to the cwd)."""
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setenv("OI_ENDPOINT", "https://s3.amazonaws.com")
+        mp.chdir(tmp_path_factory.mktemp("import"))
+        mp.syspath_prepend(DNS_RESOLUTION_DIR)
+        import dataset_collection
+        yield dataset_collection
+
+
+def openintel_object(day, part, rows=3000):
+    """An OpenINTEL-like Parquet object: the kept columns (some rows without any record value) plus a wide unused one."""
+    names = [f"d{day:%d}-{part}-{i}.example." for i in range(rows)]
+    blank = lambda values: [v if i % 5 else "" for i, v in enumerate(values)]
+    table = pa.table({
+        "query_name": names,
+        "query_type": ["A"] * rows,
+        "response_type": ["NOERROR"] * rows,
+        "ip4_address": blank([f"10.{part}.{i % 256}.1" for i in range(rows)]),
+        "ip6_address": [""] * rows,
+        "country": blank(["NL"] * rows),
+        "as": blank(["64500"] * rows),
+        "as_full": blank(["64500"] * rows),
+        "ip_prefix": blank([f"10.{part}.{i % 256}.0/24" for i in range(rows)]),
+        "rdata": [os.urandom(64).hex() for _ in range(rows)],
+    })
+    buffer = io.BytesIO()
+    pq.write_table(table, buffer, row_group_size=1000)
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def bucket(dc, tmp_path, monkeypatch):
+    """A public moto bucket with PARTS Tranco objects per day of DATES; returns {key: object bytes}."""
+    monkeypatch.chdir(tmp_path)
+    os.makedirs(dc.SAVE_DIR)
+    for name in ("AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY"):
+        monkeypatch.setenv(name, "testing")
+    with moto.mock_aws():
+        s3 = boto3.client("s3", region_name="us-east-1")
+        s3.create_bucket(Bucket=dc.OI_BUCKET_NAME, ACL="public-read")
+        objects = {}
+        for day in DATES:
+            for part in range(PARTS):
+                key = f"{dc.OI_FDNS_LISTBASED}/source=tranco/year={day:%Y}/month={day:%m}/day={day:%d}/part-{part:05d}.gz.parquet"
+                objects[key] = openintel_object(day, part)
+                s3.put_object(Bucket=dc.OI_BUCKET_NAME, Key=key, Body=objects[key], ACL="public-read")
+        yield objects
+
+
+@pytest.fixture
+def range_calls(dc, monkeypatch):
+    """Count ranged GETs; set calls["fail_after"] to make later GETs fail like a dropped connection."""
+    calls = {"count": 0, "fail_after": None}
+    get_range = dc.get_range
+
+    def counting_get_range(*args, **kwargs):
+        calls["count"] += 1
+        if calls["fail_after"] is not None and calls["count"] > calls["fail_after"]:
+            raise ConnectionResetError("connection reset")
+        return get_range(*args, **kwargs)
+
+    monkeypatch.setattr(dc, "get_range", counting_get_range)
+    return calls
+
+
+def expected_rows(objects):
+    return sum(len(pq.read_table(io.BytesIO(data)).to_pandas().replace("", pd.NA).dropna(subset=["ip4_address", "ip6_address", "country", "as", "as_full", "ip_prefix"], how="all"))
+               for data in objects.values())
+
+
+def journal(dc):
+    with open(os.path.join(dc.STORE_DIR, "journal.jsonl")) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_manifest_only_lists_new_keys(dc, bucket):
+    manifest = dc.load_manifest(["tranco"])
+    assert manifest.dates("tranco") == [day.date() for day in reversed(DATES)]
+    assert {obj["key"] for day in DATES for obj in manifest.objects("tranco", day.date())} == set(bucket)
+
+    key = f"{dc.OI_FDNS_LISTBASED}/source=tranco/year=2025/month=04/day=16/part-00000.gz.parquet"
+    boto3.client("s3", region_name="us-east-1").put_object(Bucket=dc.OI_BUCKET_NAME, Key=key, Body=b"PAR1", ACL="public-read")
+    manifest = dc.S3Manifest.load()
+    start_after = manifest.df["key"].max()
+    assert [obj["Key"] for obj in dc.list_keys(dc.source_prefix("tranco"), start_after)] == [key]
+    manifest.update(["tranco"])
+    assert manifest.dates("tranco")[0] == datetime.date(2025, 4, 16)
+
+
+def test_pipeline_writes_the_filtered_rows_to_the_dataset(dc, bucket, monkeypatch):
+    monkeypatch.setattr(dc, "RANGE_MERGE_GAP", 0)  # The test objects are far smaller than the default gap
+    stats = asyncio.run(dc.collect_pipelined(["tranco"], DATES))
+    assert [stats[name].items for name in ("list", "fetch", "decode", "write")] == [len(DATES)] + [len(bucket)] * 3
+    assert sum(stats[name].failed for name in stats) == 0
+    # Only the footer and the kept columns are fetched, not the wide rdata column
+    assert stats["fetch"].bytes < sum(map(len, bucket.values())) / 2
+
+    week = dc.week_view(DATES[0].date()).to_table()
+    assert week.num_rows == expected_rows(bucket)
+    assert week.schema.field("query_name").type == pa.dictionary(pa.int32(), pa.string())
+    assert week.column("country").null_count == 0
+    assert len(glob.glob(os.path.join(dc.DATASET_DIR, "source=tranco", "year=2025", "month=04", "day=14", "*.parquet"))) == PARTS
+    assert sorted(entry["key"] for entry in journal(dc)) == sorted(bucket)
+
+
+def test_each_stage_runs_in_its_own_bounded_thread_pool(dc, bucket, monkeypatch):
+    monkeypatch.setitem(dc.STAGE_WORKERS, "decode", 1)
+    threads = {}
+    for name in ("fetch_projection", "filter_record_batches", "save_dataset_part"):
+        def record(*args, _name=name, _fn=getattr(dc, name), **kwargs):
+            threads.setdefault(_name, set()).add(threading.current_thread().name)
+            return _fn(*args, **kwargs)
+        monkeypatch.setattr(dc, name, record)
+    asyncio.run(dc.collect_pipelined(["tranco"], DATES))
+    assert all(thread.startswith("fetch-stage") for thread in threads["fetch_projection"])
+    assert len(threads["fetch_projection"]) <= dc.STAGE_WORKERS["fetch"]
+    assert len(threads["filter_record_batches"]) == 1 and next(iter(threads["filter_record_batches"])).startswith("decode-stage")
+    assert all(thread.startswith("write-stage") for thread in threads["save_dataset_part"])
+
+def test_projection_matches_a_full_read(dc, bucket, monkeypatch):
+    monkeypatch.setattr(dc, "RANGE_MERGE_GAP", 0)
+    key, data = next(iter(bucket.items()))
+    projection = dc.fetch_projection(key, len(data))
+    assert projection.fetched_bytes < len(data) / 2
+    assert dc.filter_record_batches(projection).equals(dc.filter_record_batches(io.BytesIO(data)))
+
+
+def test_decode_treats_blank_large_and_dictionary_strings_as_missing(dc):
+    table = pa.table({
+        "query_name": pa.array(["a.", "b.", "c."], pa.large_string()),
+        "ip4_address": pa.array(["", "10.0.0.1", ""], pa.large_string()),
+        "country": pa.array(["", "", ""]).dictionary_encode(),
+        "as": pa.array(["", "", "64500"]).dictionary_encode(),
+    })
+    buffer = io.BytesIO()
+    pq.write_table(table, buffer)
+    buffer.seek(0)
+    assert dc.filter_record_batches(buffer).column("query_name").to_pylist() == ["b.", "c."]
+
+
+def test_rerun_skips_journaled_objects(dc, bucket, range_calls):
+    asyncio.run(dc.collect_pipelined(["tranco"], DATES))
+    fetched = range_calls["count"]
+    stats = asyncio.run(dc.collect_pipelined(["tranco"], DATES))
+    assert range_calls["count"] == fetched
+    assert stats["fetch"].items == stats["write"].items == 0
+    assert len(journal(dc)) == len(bucket)
+
+
+def test_interrupted_pipeline_resumes_from_fetched_ranges(dc, bucket, range_calls):
+    asyncio.run(dc.collect_pipelined(["tranco"], DATES))
+    complete_run = range_calls["count"]
+    os.remove(os.path.join(dc.STORE_DIR, "journal.jsonl"))
+
+    range_calls.update(count=0, fail_after=3)
+    stats = asyncio.run(dc.collect_pipelined(["tranco"], DATES))
+    assert stats["fetch"].failed > 0
+    kept = glob.glob(os.path.join(dc.STORE_DIR, "objects", "*", "*", "*.range"))
+    assert kept
+
+    range_calls.update(count=0, fail_after=None)
+    stats = asyncio.run(dc.collect_pipelined(["tranco"], DATES))
+    assert stats["write"].failed == 0
+    assert range_calls["count"] == complete_run - 3  # The 3 ranges fetched before the crash are not fetched again
+    assert len(journal(dc)) == len(bucket)
+    assert not glob.glob(os.path.join(dc.STORE_DIR, "objects", "*", "*"))
+    assert dc.week_view(DATES[0].date()).count_rows() == expected_rows(bucket)
+
+
+def test_threaded_download_resumes_a_partial_object(dc, bucket, range_calls, monkeypatch):
+    monkeypatch.setattr(dc, "DO_SOURCES", ["tranco"])
+    monkeypatch.setattr(dc, "RESUME_CHUNK_BYTES", 64 * 1024)
+    range_calls["fail_after"] = 2
+    dc.collect_threaded(DATES[:1])
+    partial = glob.glob(os.path.join(dc.STORE_DIR, "objects", "*", "*", "*.part"))
+    assert sum(os.path.getsize(path) for path in partial) == 2 * 64 * 1024
+
+    range_calls.update(count=0, fail_after=None)
+    dc.collect_threaded(DATES[:1])
+    day_objects = {key: data for key, data in bucket.items() if "day=14" in key}
+    assert sorted(entry["key"] for entry in journal(dc)) == sorted(day_objects)
+    assert range_calls["count"] < sum(-(-len(data) // (64 * 1024)) for data in day_objects.values())
+    assert dc.week_view(DATES[0].date()).count_rows() == expected_rows(day_objects)
+
+
+def test_rewritten_object_replaces_its_dataset_part(dc, bucket):
+    asyncio.run(dc.collect_pipelined(["tranco"], DATES))
+    key = next(iter(bucket))
+    bucket[key] = openintel_object(DATES[0], 7, rows=1000)
+    boto3.client("s3", region_name="us-east-1").put_object(Bucket=dc.OI_BUCKET_NAME, Key=key, Body=bucket[key], ACL="public-read")
+
+    manifest = dc.S3Manifest.load()
+    manifest.update(["tranco"], refresh=True)
+    stats = asyncio.run(dc.collect_pipelined(["tranco"], DATES, manifest=manifest))
+    assert stats["write"].items == 1
+    assert len(glob.glob(os.path.join(dc.DATASET_DIR, "source=tranco", "year=2025", "month=04", "day=14", "*.parquet"))) == PARTS
+    assert dc.week_view(DATES[0].date()).count_rows() == expected_rows(bucket)
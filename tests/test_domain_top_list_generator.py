@@ -0,0 +1,113 @@
+import gzip
+import os
+import sys
+import zipfile
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "domain-top-lists"))
+import domain_top_list_generator as dtl
+
+
+def write_daily_lists(root, name, dates, size=2000):
+    """Headerless Tranco-style rank,domain files with a different domain order per day."""
+    rng = np.random.default_rng(sum(map(ord, name)))
+    for date in dates:
+        domains = rng.permutation(3 * size)[:size]
+        with open(root / f"{name}-{date:%Y-%m-%d}.csv", "w") as f:
+            f.writelines(f"{rank},d{domain}.example\n" for rank, domain in enumerate(domains, start=1))
+
+
+@pytest.fixture
+def daily_sources(tmp_path):
+    dates = pd.date_range("2025-04-01", "2025-04-10")
+    for name in ("a", "b"):
+        write_daily_lists(tmp_path, name, dates)
+    return {name.upper(): (str(tmp_path / f"{name}-{{date}}.csv"), False) for name in ("a", "b")}
+
+
+def test_batch_with_small_cache_matches_large_cache(tmp_path, daily_sources):
+    # Two overlapping weeks; one daily list is ~32 KB, so 50 KB cannot hold a week's 14 files
+    weeks = [("2025-04-01", "2025-04-07"), ("2025-04-04", "2025-04-10")]
+    registry = dtl.DomainRegistry()
+    small = dtl.process_weeks_batch(weeks, daily_sources, output_root=str(tmp_path / "small"), cache_bytes=50_000, registry=registry)
+    large = dtl.process_weeks_batch(weeks, daily_sources, output_root=str(tmp_path / "large"), registry=registry)
+    assert small.keys() == large.keys() == {"20250401_to_20250407", "20250404_to_20250410"}
+    for week_id in small:
+        pd.testing.assert_frame_equal(small[week_id], large[week_id])
+
+
+def test_cache_never_evicts_pinned_entries():
+    cache = dtl.DailyListCache(max_bytes=200)
+    df = pd.DataFrame({"domain_id": np.arange(10, dtype=np.int32), "rank": np.arange(10, dtype=np.int32), "weight": np.ones(10)})
+    cache.pin(["x", "y"])
+    cache.put("x", df)
+    cache.put("y", df)
+    assert "x" in cache and "y" in cache
+    cache.pin(())
+    assert "x" not in cache and "y" in cache
+
+
+# Daily lists in every supported layout, with the cases clean_domain handles: case, whitespace,
+# schemes, paths, ports, "www." (also inside the name), missing values and non-numeric ranks
+LIST_ROWS = ["Example.com", " www.Shop.example ", "https://www.news.example/path?q=1", "http://api.example:8080",
+             "sub.www2.example", "WWW.Upper.example", "", "#N/A", "plain-www.example", "a.example/", "ftp://files.example"]
+LIST_LAYOUTS = {
+    "tranco.csv": (False, lambda rows: [f"{i},{d}" for i, d in enumerate(rows, 1)]),
+    "crux.csv": (True, lambda rows: ["origin,rank"] + [f"{d},{1000 * (1 + i // 3)}" for i, d in enumerate(rows)]),
+    "majestic.csv": (True, lambda rows: ["GlobalRank,TldRank,Domain,TLD"] + [f"{i},{i},{d},com" for i, d in enumerate(rows, 1)]),
+    "majestic_bom.csv": (True, lambda rows: ["\ufeffGlobalRank,TldRank,Domain,TLD"] + [f"{i},{i},{d},com" for i, d in enumerate(rows, 1)]),
+    "domain_rank.csv": (True, lambda rows: ["domain,rank"] + [f"{d},{'x' if i == 2 else i}" for i, d in enumerate(rows, 1)]),
+    "radar.csv": (True, lambda rows: ["domain"] + rows),
+}
+
+
+@pytest.mark.parametrize("layout", sorted(LIST_LAYOUTS))
+@pytest.mark.parametrize("archive", ["", ".gz", ".zip"])
+def test_arrow_loader_returns_the_same_rows_as_pandas(tmp_path, layout, archive):
+    has_header, render = LIST_LAYOUTS[layout]
+    text = "\n".join(render(LIST_ROWS)) + "\n"
+    path = tmp_path / layout
+    path.write_text(text, encoding="utf-8")
+    expected = dtl.load_domain_top_list_pandas(str(path), has_header).reset_index(drop=True)
+    if archive == ".gz":
+        with gzip.open(f"{path}.gz", "wt", encoding="utf-8") as f:
+            f.write(text)
+    elif archive == ".zip":
+        with zipfile.ZipFile(f"{path}.zip", "w") as f:
+            f.write(path, layout)
+    loaded = dtl.load_domain_top_list_arrow(f"{path}{archive}", has_header).reset_index(drop=True)
+    pd.testing.assert_frame_equal(loaded, expected, check_dtype=False)
+
+
+def legacy_merge_and_average_zipf_weights(df_list):
+    """The pairwise outer-merge implementation merge_and_average_zipf_weights replaced."""
+    for i, df in enumerate(df_list):
+        df = df.groupby("domain", as_index=False)["weight"].mean()
+        df.columns = ["domain", f"weight_{i}"]
+        df_list[i] = df
+    merged_df = df_list[0]
+    for df in df_list[1:]:
+        merged_df = merged_df.merge(df, on="domain", how="outer")
+    merged_df.fillna(0, inplace=True)
+    weight_columns = [col for col in merged_df.columns if col.startswith("weight_")]
+    merged_df["final_weight"] = merged_df[weight_columns].mean(axis=1)
+    merged_df["final_weight"] /= merged_df["final_weight"].sum()
+    return merged_df[["domain", "final_weight"]]
+
+
+def test_merge_matches_the_pairwise_outer_merge():
+    rng = np.random.default_rng(4)
+    registry = dtl.DomainRegistry()
+    sources = []
+    for size in (500, 800, 300):
+        domains = np.array([f"d{i}.example" for i in rng.integers(0, 1200, size)], dtype=object)  # overlapping, with duplicates
+        sources.append(pd.DataFrame({"domain": domains, "weight": rng.random(size)}))
+    merged = dtl.merge_and_average_zipf_weights(
+        [pd.DataFrame({"domain_id": registry.encode(df["domain"]), "weight": df["weight"]}) for df in sources])
+    legacy = legacy_merge_and_average_zipf_weights(sources).set_index("domain")["final_weight"]
+    merged = pd.Series(merged["final_weight"].to_numpy(), index=registry.decode(merged["domain_id"]))
+    assert merged.index.sort_values().equals(legacy.index.sort_values())
+    np.testing.assert_array_equal(merged.reindex(legacy.index).to_numpy(), legacy.to_numpy())
@@ -0,0 +1,244 @@
+import csv
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "prefix-top-lists"))
+import prefix_top_list_generation as ptl
+from domain_top_list_generator import DomainRegistry
+
+
+def write_part(path, rows):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    pq.write_table(pa.table({
+        "query_name": [f"d{i}.example." for i in rows],
+        "ip4_address": [f"10.0.{i % 256}.1" for i in rows],
+        "ip6_address": [None] * len(rows),
+        "ip_prefix": [f"10.0.{i % 256}.0/24" for i in rows],
+        "as": ["64500"] * len(rows),
+    }), path)
+
+
+@pytest.fixture
+def dns_partition(tmp_path):
+    day = tmp_path / "dataset" / "source=tranco" / "year=2025" / "month=04" / "day=14"
+    write_part(str(day / "part-a.parquet"), range(10))
+    return str(day)
+
+
+def build_index(index_dir, dns_files):
+    registry = DomainRegistry()
+    ptl.save_dns_index(ptl.load_dns_edges(dns_files, registry=registry), index_dir, registry, dns_files)
+
+
+def test_dns_index_is_stale_after_a_part_is_added(tmp_path, dns_partition):
+    index_dir = str(tmp_path / "dns_index")
+    build_index(index_dir, [dns_partition])
+    assert ptl.dns_index_matches(index_dir, [dns_partition])
+    write_part(os.path.join(dns_partition, "part-b.parquet"), range(10, 20))
+    assert not ptl.dns_index_matches(index_dir, [dns_partition])
+
+
+def test_dns_index_is_stale_after_a_file_is_rewritten(tmp_path, dns_partition):
+    dns_file = os.path.join(dns_partition, "part-a.parquet")
+    index_dir = str(tmp_path / "dns_index")
+    build_index(index_dir, [dns_file])
+    assert ptl.dns_index_matches(index_dir, [dns_file])
+    time.sleep(0.01)
+    write_part(dns_file, range(5))
+    assert not ptl.dns_index_matches(index_dir, [dns_file])
+
+
+@pytest.mark.parametrize("options", [{"pfx2as_file": "routeviews.pfx2as.gz"}, {"rollup": True}, {"index_dir": "dns_index"},
+                                     {"output_format": "parquet"}, {"top_n": 10}])
+def test_out_of_core_build_rejects_unsupported_options(tmp_path, options):
+    with pytest.raises(ValueError, match=next(iter(options))):
+        ptl.run_pipeline("test", [], str(tmp_path / "weights.csv"), str(tmp_path / "pfx.csv"), str(tmp_path / "as.csv"),
+                         memory_budget=1 << 20, **options)
+
+
+def test_sharded_build_rejects_index_dir(tmp_path):
+    with pytest.raises(ValueError, match="index_dir"):
+        ptl.run_pipeline("test", [], str(tmp_path / "weights.csv"), str(tmp_path / "pfx.csv"), str(tmp_path / "as.csv"),
+                         index_dir=str(tmp_path / "dns_index"), workers=4)
+
+
+def legacy_top_lists(dns_filepaths, weight_csv_path, is_frequency=False):
+    """The dict-loop process_dns_files + distribute_weights the columnar engine replaced, returning (PTL, ATL)."""
+    canonicalize = ptl.canonicalize_domain
+    domain2ip, ip2pfx, pfx2as = {}, {}, {}
+    for filepath in dns_filepaths:
+        with open(filepath) as csvfile:
+            for row in csv.DictReader(csvfile):
+                domain = canonicalize(row["query_name"].rstrip("."))
+                ip, pfx, asn = row["ip4_address"] or row["ip6_address"], row["ip_prefix"], row["as"]
+                if not ip or not pfx or not domain or (not pfx.count(".") and ":" not in pfx):
+                    continue
+                domain2ip.setdefault(domain, []).append(ip) if ip not in domain2ip.get(domain, []) else None
+                ip2pfx.setdefault(ip, []).append(pfx) if pfx not in ip2pfx.get(ip, []) else None
+                pfx2as.setdefault(pfx, set()).add(asn) if asn else None
+    ip2pfx = {ip: list(set(pfxes)) for ip, pfxes in ip2pfx.items()}
+
+    df = pd.read_csv(weight_csv_path).rename(columns={"frequency" if is_frequency else "final_weight": "weight"})
+    df["domain"] = df["domain"].apply(canonicalize)
+    df = df[df["domain"].isin(domain2ip)]
+    if is_frequency or abs(df["weight"].sum() - 1.0) > 0.05:
+        df["weight"] = df["weight"] / df["weight"].sum()
+
+    pfx_weights, pfx_domains, pfx_ips, ip_weights, ip2domain = {}, {}, {}, {}, {}
+    for _, row in df.iterrows():
+        ips = domain2ip.get(row["domain"], [])
+        for ip in ips:
+            ip_weights[ip] = ip_weights.get(ip, 0) + row["weight"] / len(ips)
+            ip2domain.setdefault(ip, set()).add(row["domain"])
+    for ip, weight in ip_weights.items():
+        for pfx in ip2pfx.get(ip, []):
+            pfx_weights[pfx] = pfx_weights.get(pfx, 0) + weight
+            pfx_domains.setdefault(pfx, set()).update(ip2domain.get(ip, []))
+    for ip, pfxs in ip2pfx.items():
+        for pfx in pfxs:
+            pfx_ips.setdefault(pfx, set()).add(ip)
+    df_pfx = pd.DataFrame([{"prefix": pfx, "weight": pfx_weights[pfx], "domains": ", ".join(sorted(pfx_domains[pfx])),
+                            "ips": ", ".join(sorted(pfx_ips.get(pfx, set()))), "ases": ", ".join(sorted(pfx2as.get(pfx, set())))}
+                           for pfx in pfx_weights])
+
+    as_weights, as_prefixes, as_domains, as_ips = {}, {}, {}, {}
+    for pfx, weight in pfx_weights.items():
+        for asn in pfx2as.get(pfx, []):
+            as_weights[asn] = as_weights.get(asn, 0) + weight
+            as_prefixes.setdefault(asn, set()).add(pfx)
+            as_domains.setdefault(asn, set()).update(pfx_domains[pfx])
+            as_ips.setdefault(asn, set()).update(pfx_ips.get(pfx, set()))
+    df_as = pd.DataFrame([{"asn": asn, "weight": as_weights[asn], "prefixes": ", ".join(sorted(as_prefixes[asn])),
+                           "domains": ", ".join(sorted(as_domains[asn])), "ips": ", ".join(sorted(as_ips[asn]))}
+                          for asn in as_weights])
+    return df_pfx, df_as
+
+
+def write_dns_week(root, days=3, domains=400, seed=11):
+    """OpenINTEL-like CSVs: multi-IP and www./trailing-dot domains, IPs in several prefixes, IPv6, multi-origin and missing ASes."""
+    rng = np.random.default_rng(seed)
+    paths = []
+    for day in range(days):
+        path = root / f"tranco_2025-04-{14 + day}.csv"
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["query_name", "query_type", "ip4_address", "ip6_address", "ip_prefix", "as"])
+            for _ in range(domains * 3):
+                d = int(rng.integers(domains))
+                name = f"{'www.' if d % 7 == 0 and rng.random() < 0.5 else ''}d{d}.example."
+                if d % 11 == 0:
+                    block = int(rng.integers(4))
+                    row = [name, "AAAA", "", f"2001:db8:{block}::{d % 3}", f"2001:db8:{block}::/48", str(64600 + block)]
+                else:
+                    block = int(rng.integers(40))
+                    ip = f"10.{block}.{d % 5}.{d % 3}"
+                    prefix = f"10.{block}.0.0/{16 if rng.random() < 0.2 else 24}"
+                    asn = "" if block % 13 == 0 else str(64500 + (block % 6 if rng.random() < 0.9 else block % 6 + 1))
+                    row = [name, "A", ip, "", prefix if rng.random() > 0.02 else "bogus", asn]
+                writer.writerow(row)
+        paths.append(str(path))
+    return paths
+
+
+@pytest.fixture
+def dns_week(tmp_path):
+    dns_files = write_dns_week(tmp_path)
+    rng = np.random.default_rng(5)
+    names = [f"{'www.' if i % 9 == 0 else ''}d{i}.example" for i in range(500)]  # Some not in DNS
+    weights = rng.random(len(names))
+    pd.DataFrame({"domain": names, "final_weight": weights / weights.sum(), "frequency": rng.integers(1, 6, len(names))}
+                 ).to_csv(tmp_path / "dtl.csv", index=False)
+    return dns_files, str(tmp_path / "dtl.csv")
+
+
+def read_top_list(path):
+    df = pd.read_csv(path, dtype=str, keep_default_na=False)
+    return df.assign(weight=df["weight"].astype(float))
+
+
+def assert_same_top_list(actual, expected, key, rtol=0.0):
+    actual, expected = actual.set_index(key).sort_index(), expected.set_index(key).sort_index()
+    assert list(actual.index) == list(expected.index)
+    if rtol:
+        np.testing.assert_allclose(actual["weight"].to_numpy(), expected["weight"].to_numpy(), rtol=rtol)
+    else:
+        np.testing.assert_array_equal(actual["weight"].to_numpy(), expected["weight"].to_numpy())
+    for column in expected.columns.drop("weight"):
+        assert actual[column].tolist() == expected[column].tolist(), column
+
+
+@pytest.mark.parametrize("is_frequency", [False, True])
+def test_propagation_engine_matches_the_dict_loops(tmp_path, dns_week, is_frequency):
+    dns_files, weight_file = dns_week
+    ptl.run_pipeline("test", dns_files, weight_file, str(tmp_path / "pfx.csv"), str(tmp_path / "as.csv"), is_frequency=is_frequency)
+    legacy_pfx, legacy_as = legacy_top_lists(dns_files, weight_file, is_frequency=is_frequency)
+    assert_same_top_list(read_top_list(tmp_path / "pfx.csv"), legacy_pfx, "prefix")
+    # The legacy loops add prefix weights to ASes in list(set(...)) order, which follows the per-process
+    # string hash seed, so AS sums can only be reproduced up to the last bit
+    assert_same_top_list(read_top_list(tmp_path / "as.csv"), legacy_as, "asn", rtol=1e-15)
+
+
+def test_sparse_propagation_matches_the_dict_loops(tmp_path, dns_week):
+    dns_files, weight_file = dns_week
+    variants = [dict(weight_file=weight_file, pfx_out=str(tmp_path / "pfx_ranked.csv"), as_out=str(tmp_path / "as_ranked.csv")),
+                dict(weight_file=weight_file, is_frequency=True, pfx_out=str(tmp_path / "pfx_presence.csv"), as_out=str(tmp_path / "as_presence.csv"))]
+    ptl.run_multi_pipeline("test", dns_files, variants)
+    for variant in variants:
+        legacy_pfx, legacy_as = legacy_top_lists(dns_files, weight_file, is_frequency=variant.get("is_frequency", False))
+        assert_same_top_list(read_top_list(variant["pfx_out"]), legacy_pfx, "prefix", rtol=1e-12)
+        assert_same_top_list(read_top_list(variant["as_out"]), legacy_as, "asn", rtol=1e-12)
+
+
+def test_index_runs_match_parsed_runs(tmp_path, dns_week):
+    dns_files, weight_file = dns_week
+    index_dir = str(tmp_path / "dns_index")
+    build_index(index_dir, dns_files)
+    index, registry = ptl.load_dns_index(index_dir)
+    assert isinstance(index.domain_ip[1], np.memmap) and isinstance(index.ips, pa.Array)
+    assert registry.names == []  # Domains stay in the mapped Arrow dictionary
+
+    ptl.run_pipeline("test", dns_files, weight_file, str(tmp_path / "pfx.csv"), str(tmp_path / "as.csv"))
+    ptl.run_pipeline("test", dns_files, weight_file, str(tmp_path / "pfx_index.csv"), str(tmp_path / "as_index.csv"), index_dir=index_dir)
+    assert_same_top_list(read_top_list(tmp_path / "pfx_index.csv"), read_top_list(tmp_path / "pfx.csv"), "prefix")
+    assert_same_top_list(read_top_list(tmp_path / "as_index.csv"), read_top_list(tmp_path / "as.csv"), "asn")
+
+    variants = [dict(weight_file=weight_file, is_frequency=True, pfx_out=str(tmp_path / "pfx_sparse.csv"), as_out=str(tmp_path / "as_sparse.csv"))]
+    ptl.run_multi_pipeline("test", dns_files, variants, index_dir=index_dir)
+    legacy_pfx, legacy_as = legacy_top_lists(dns_files, weight_file, is_frequency=True)
+    assert_same_top_list(read_top_list(tmp_path / "pfx_sparse.csv"), legacy_pfx, "prefix", rtol=1e-12)
+    assert_same_top_list(read_top_list(tmp_path / "as_sparse.csv"), legacy_as, "asn", rtol=1e-12)
+
+
+@pytest.mark.parametrize("is_frequency", [False, True])
+def test_sharded_build_matches_the_single_process_build(tmp_path, dns_week, is_frequency):
+    dns_files, weight_file = dns_week
+    ptl.run_pipeline("test", dns_files, weight_file, str(tmp_path / "pfx.csv"), str(tmp_path / "as.csv"), is_frequency=is_frequency)
+    ptl.run_pipeline("test", dns_files, weight_file, str(tmp_path / "pfx_sharded.csv"), str(tmp_path / "as_sharded.csv"),
+                     is_frequency=is_frequency, workers=3)
+    # Shard sums are added (and normalized) after the merge, so weights may differ in the last bits
+    assert_same_top_list(read_top_list(tmp_path / "pfx_sharded.csv"), read_top_list(tmp_path / "pfx.csv"), "prefix", rtol=1e-12)
+    assert_same_top_list(read_top_list(tmp_path / "as_sharded.csv"), read_top_list(tmp_path / "as.csv"), "asn", rtol=1e-12)
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+def test_out_of_core_build_matches_the_in_memory_build(tmp_path, dns_week, workers):
+    dns_files, weight_file = dns_week
+    memory_budget = sum(os.path.getsize(path) for path in dns_files) // 2
+    assert ptl.spill_partitions(dns_files, memory_budget) >= 4
+    ptl.run_pipeline("test", dns_files, weight_file, str(tmp_path / "pfx.csv"), str(tmp_path / "as.csv"))
+    ptl.run_pipeline("test", dns_files, weight_file, str(tmp_path / "pfx_ooc.csv"), str(tmp_path / "as_ooc.csv"),
+                     memory_budget=memory_budget, workers=workers)
+
+    count = lambda joined: joined.map(lambda members: len(members.split(", ")) if members else 0).astype(str)
+    df_pfx, df_as = read_top_list(tmp_path / "pfx.csv"), read_top_list(tmp_path / "as.csv")
+    expected_pfx = df_pfx.assign(num_ips=count(df_pfx["ips"]))[["prefix", "weight", "num_ips", "ases"]]
+    expected_as = df_as.assign(num_prefixes=count(df_as["prefixes"]))[["asn", "weight", "num_prefixes"]]
+    assert_same_top_list(read_top_list(tmp_path / "pfx_ooc.csv"), expected_pfx, "prefix", rtol=1e-12)
+    assert_same_top_list(read_top_list(tmp_path / "as_ooc.csv"), expected_as, "asn", rtol=1e-12)